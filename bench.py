@@ -0,0 +1,538 @@
+import asyncio
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+from wsaio.capture import TrafficCapture, replay
+from wsaio.client import WebSocketClient
+from wsaio.connection import BinaryEvent, CloseEvent, TextEvent, WebSocketConnection
+from wsaio.handshake import WebSocketHandshake, build_request_template
+from wsaio.loops import get_loop_implementations, new_event_loop
+from wsaio.mux import Multiplexer
+from wsaio.pubsub import PubSub
+from wsaio.reader import WebSocketReader
+from wsaio.stream import Stream, StreamProtocol
+from wsaio.timer import TimerWheel
+from wsaio.util import (
+    MaskKeyPool,
+    genmask,
+    genseckey,
+    seededsource,
+    zerosource,
+)
+from wsaio.writer import WebSocketWriter
+
+from peer import PeerProtocol, make_response
+
+URLINFO = ('localhost', 9001, '/', '')
+
+
+def run(name, func, number):
+    start = time.perf_counter()
+
+    for _ in range(number):
+        func()
+
+    elapsed = time.perf_counter() - start
+    print(f'{name}: {number / elapsed:,.0f} ops/sec')
+
+
+def run_async(name, loop, func, number):
+    async def runner():
+        for _ in range(number):
+            await func()
+
+    start = time.perf_counter()
+    loop.run_until_complete(runner())
+
+    elapsed = time.perf_counter() - start
+    print(f'{name}: {number / elapsed:,.0f} ops/sec')
+
+
+def measure(name, func, count):
+    func()  # Warm up caches so they aren't counted
+
+    tracemalloc.start()
+
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    print(
+        f'{name}: {peak / count:,.1f} peak bytes/frame, '
+        f'{current / count:,.1f} retained bytes/frame'
+    )
+
+
+class NullStream:
+    def __init__(self, loop):
+        self.loop = loop
+
+    def write(self, data):
+        pass
+
+    async def wait_until_drained(self):
+        pass
+
+    def is_closing(self):
+        return False
+
+
+class LinkStream(NullStream):
+    """A stream that drains at a fixed bandwidth in bytes per second."""
+
+    def __init__(self, loop, bandwidth):
+        super().__init__(loop)
+        self.bandwidth = bandwidth
+        self.pending = 0
+
+    def write(self, data):
+        self.pending += len(data)
+
+    async def wait_until_drained(self):
+        pending, self.pending = self.pending, 0
+        await asyncio.sleep(pending / self.bandwidth)
+
+
+def bench_handshake(loop, *, segment=None):
+    seckey = genseckey().encode('utf-8')
+    response = make_response(seckey)
+
+    if segment is None:
+        chunks = [response]
+    else:
+        chunks = [response[i:i + segment] for i in range(0, len(response), segment)]
+
+    def handshake():
+        head, tail = build_request_template(*URLINFO)
+        b''.join((head, seckey, tail))
+
+        stream = Stream(loop=loop)
+        handshake = WebSocketHandshake(URLINFO, stream=stream)
+
+        for chunk in chunks:
+            stream._ctx.feed_data(chunk)
+
+        handshake._future.result()
+
+    return handshake
+
+
+def os_genmask():
+    return os.urandom(4)
+
+
+def bench_write(loop, *, size, genmask=genmask):
+    writer = WebSocketWriter(stream=NullStream(loop), genmask=genmask)
+    data = b'x' * size
+
+    async def write():
+        await writer.write(data, binary=True, mask=True)
+
+    return write
+
+
+def measure_write(loop, *, size, max_frame_size=None):
+    connection = WebSocketConnection(max_frame_size=max_frame_size)
+    writer = WebSocketWriter(stream=NullStream(loop), connection=connection)
+    data = b'x' * size
+
+    tracemalloc.start()
+
+    try:
+        loop.run_until_complete(writer.write(data, binary=True, mask=True))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    name = f'{max_frame_size}-byte frames' if max_frame_size else 'one frame'
+    print(f'write {size >> 20} MiB masked message ({name}): {peak:,} peak bytes')
+
+
+def measure_write_allocations(loop, *, size, count):
+    writer = WebSocketWriter(stream=NullStream(loop))
+    data = b'x' * size
+
+    async def write():
+        for _ in range(count):
+            await writer.write(data, binary=True, mask=True)
+
+    loop.run_until_complete(write())  # Warm up caches so they aren't counted
+
+    tracemalloc.start()
+
+    try:
+        loop.run_until_complete(write())
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Nothing outlives a write, so the peak is what a single write allocates at once
+    print(
+        f'write {size}-byte masked frame: {peak:,} peak bytes/write, '
+        f'{current / count:,.1f} retained bytes/write'
+    )
+
+
+def bench_publish(loop, *, subscribers, size):
+    pubsub = PubSub()
+    for _ in range(subscribers):
+        pubsub.subscribe('topic', WebSocketWriter(stream=NullStream(loop)))
+
+    data = b'x' * size
+
+    def publish():
+        pubsub.publish('topic', data, binary=True)
+
+    return publish
+
+
+def bench_mux(loop, *, quantum, bandwidth=100e6):
+    # 64 queued 64 KiB bulk messages share a 100 MB/s link with small
+    # messages sent every 5 ms on another channel
+    writer = WebSocketWriter(stream=LinkStream(loop, bandwidth))
+    multiplexer = Multiplexer(window=1 << 30, quantum=quantum)
+    multiplexer.attach(writer)
+
+    bulk = multiplexer.open_channel()
+    chat = multiplexer.open_channel()
+    latencies = []
+
+    async def send_chat():
+        for _ in range(20):
+            start = time.perf_counter()
+            await chat.send(b'x' * 16)
+            latencies.append(time.perf_counter() - start)
+
+            await asyncio.sleep(0.005)
+
+    async def main():
+        data = b'x' * (1 << 16)
+        await asyncio.gather(send_chat(), *(bulk.send(data) for _ in range(64)))
+
+    loop.run_until_complete(main())
+
+    latencies.sort()
+    print(
+        f'mux 16-byte messages behind bulk channel ({quantum:,}-byte quantum): '
+        f'{latencies[len(latencies) // 2] * 1000:.2f} ms median, '
+        f'{latencies[-1] * 1000:.2f} ms max latency'
+    )
+
+
+def bench_parse(*, size, count, segment=None):
+    sender = WebSocketConnection(mask=True, genmask=MaskKeyPool(source=zerosource))
+    for _ in range(count):
+        sender.write(b'x' * size, binary=True)
+
+    data = sender.data_to_send()
+
+    if segment is None:
+        chunks = [data]
+    else:
+        chunks = [data[i:i + segment] for i in range(0, len(data), segment)]
+
+    def parse():
+        connection = WebSocketConnection()
+
+        for chunk in chunks:
+            connection.receive_data(chunk)
+            for _ in connection.events():
+                pass
+
+    return parse
+
+
+def make_capture(*, size, count, segment):
+    sender = WebSocketConnection(genmask=MaskKeyPool(source=zerosource))
+    for _ in range(count):
+        sender.write(b'x' * size, binary=True)
+
+    data = sender.data_to_send()
+
+    file = io.BytesIO()
+    capture = TrafficCapture(file)
+    for i in range(0, len(data), segment):
+        capture.record(data[i:i + segment])
+
+    return file.getvalue()
+
+
+def bench_replay(loop, capture):
+    async def callback(*args):
+        pass
+
+    async def replay_capture():
+        stream = Stream(loop=loop)
+        reader = WebSocketReader(stream=stream)
+        reader._on_text = reader._on_binary = reader._on_close = callback
+        reader._on_ping = reader._on_pong = callback
+
+        stream.set_parser(reader.read_frame)
+        await replay(io.BytesIO(capture), stream)
+
+    return replay_capture
+
+
+def bench_timers(loop, count, rounds=5):
+    def callback():
+        pass
+
+    # Every connection resets its timeout once per round, like an idle timeout
+    # that is pushed back whenever a message arrives
+    async def churn(call_later):
+        timers = [call_later(30 + i % 60, callback) for i in range(count)]
+        scheduled = len(loop._scheduled)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for i, timer in enumerate(timers):
+                timer.cancel()
+                timers[i] = call_later(30 + i % 60, callback)
+
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+
+        for timer in timers:
+            timer.cancel()
+
+        return elapsed, scheduled
+
+    for name, call_later in (
+        ('call_later', loop.call_later),
+        ('timer wheel', TimerWheel(loop=loop).call_later),
+    ):
+        elapsed, scheduled = loop.run_until_complete(churn(call_later))
+        print(
+            f'reset {count:,} connection timeouts ({name}): '
+            f'{count * rounds / elapsed:,.0f} ops/sec, {scheduled:,} loop handles'
+        )
+
+
+def measure_idle(loop, count):
+    connections = []
+
+    tracemalloc.start()
+
+    try:
+        for _ in range(count):
+            stream = Stream(loop=loop)
+            stream.protocol = StreamProtocol(stream)
+
+            connection = WebSocketConnection(mask=True)
+            reader = WebSocketReader(stream=stream, connection=connection)
+            writer = WebSocketWriter(stream=stream, connection=connection)
+
+            stream.set_parser(reader.read_frame)
+            connections.append((stream, reader, writer))
+
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    print(f'idle connection: {current / count:,.0f} bytes/connection (excluding the socket)')
+
+
+class BenchPeer(PeerProtocol):
+    """A minimal in-process server for the socket benchmarks.
+
+    The request path selects what it does, /echo echoes every message and
+    /stream/<count>/<size> sends count binary messages of size bytes.
+    """
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+
+        self.paused = False
+        self.remaining = 0
+        self.payload = None
+
+    def handle_handshake(self, path):
+        if path.startswith('/stream/'):
+            _, _, count, size = path.split('/')
+
+            self.remaining = int(count)
+            self.payload = b'x' * int(size)
+            self.send_stream()
+
+    def handle_events(self, events):
+        for event in events:
+            if isinstance(event, CloseEvent):
+                self.connection.close(code=event.code or 1000)
+                self.transport.write(self.connection.data_to_send())
+                self.transport.close()
+                return
+
+            if isinstance(event, (TextEvent, BinaryEvent)):
+                self.connection.write(event.data, binary=isinstance(event, BinaryEvent))
+
+        self.transport.write(self.connection.data_to_send())
+
+    def send_stream(self):
+        while self.remaining and not self.paused:
+            self.remaining -= 1
+            self.connection.write(self.payload, binary=True)
+            self.transport.write(self.connection.data_to_send())
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.send_stream()
+
+
+class BenchClient(WebSocketClient):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.waiter = None
+        self.received = 0
+
+    def expect(self, size):
+        self.waiter = self.loop.create_future()
+        self.received = size
+
+    async def on_text(self, data):
+        self.waiter.set_result(data)
+
+    async def on_binary(self, data):
+        self.received -= len(data)
+        if self.received <= 0:
+            self.waiter.set_result(None)
+
+
+def bench_socket(implementation, *, buffered, connections=500, messages=10000, size=1 << 20):
+    # Both ends run on the loop being measured, over a real TCP socket
+    loop = new_event_loop(implementation)
+
+    async def main():
+        server = await loop.create_server(BenchPeer, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def connect(path):
+            client = BenchClient(loop=loop)
+            await client.connect(f'ws://127.0.0.1:{port}{path}', buffered=buffered)
+            await asyncio.sleep(0)  # The open hook runs as a task
+            return client
+
+        start = time.perf_counter()
+        for _ in range(connections):
+            client = await connect('/echo')
+            await client.close()
+        handshakes = connections / (time.perf_counter() - start)
+
+        client = await connect('/echo')
+        start = time.perf_counter()
+        for _ in range(messages):
+            client.expect(0)
+            await client.write('x' * 16)
+            await client.waiter
+        rps = messages / (time.perf_counter() - start)
+        await client.close()
+
+        count = 100
+        client = BenchClient(loop=loop)
+        client.expect(count * size)
+        start = time.perf_counter()
+        await client.connect(f'ws://127.0.0.1:{port}/stream/{count}/{size}', buffered=buffered)
+        await client.waiter
+        throughput = count * size / (time.perf_counter() - start) / 1e6
+        await client.close()
+
+        server.close()
+        await server.wait_closed()
+
+        return handshakes, rps, throughput
+
+    try:
+        handshakes, rps, throughput = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    name = f'{implementation}, {"buffered" if buffered else "data_received"}'
+    print(
+        f'socket ({name}): {handshakes:,.0f} handshakes/sec, '
+        f'{rps:,.0f} 16-byte round trips/sec, '
+        f'{throughput:,.0f} MB/sec receiving {size >> 20} MiB messages'
+    )
+
+
+def main():
+    loop = asyncio.new_event_loop()
+
+    try:
+        run('handshake (1 segment)', bench_handshake(loop), 20000)
+        run('handshake (16-byte segments)', bench_handshake(loop, segment=16), 20000)
+        run('handshake (1-byte segments)', bench_handshake(loop, segment=1), 2000)
+
+        for name, genmask in (
+            ('urandom', os_genmask),
+            ('pooled', MaskKeyPool()),
+            ('seeded', MaskKeyPool(source=seededsource(0))),
+            ('zero', MaskKeyPool(source=zerosource)),
+        ):
+            run_async(
+                f'write 16-byte masked frame ({name} keys)', loop,
+                bench_write(loop, size=16, genmask=genmask), 100000
+            )
+
+        for size in (4096, 16384):
+            run_async(
+                f'write {size}-byte masked frame', loop, bench_write(loop, size=size), 50000
+            )
+            measure_write_allocations(loop, size=size, count=1000)
+
+        for max_frame_size in (None, 1 << 16):
+            measure_write(loop, size=16 << 20, max_frame_size=max_frame_size)
+
+        run(
+            'publish 1024-byte message to 1000 subscribers',
+            bench_publish(loop, subscribers=1000, size=1024), 200
+        )
+
+        run('parse 1000 16-byte frames', bench_parse(size=16, count=1000), 200)
+        run(
+            'parse 1000 16-byte frames (1460-byte segments)',
+            bench_parse(size=16, count=1000, segment=1460), 200
+        )
+        measure('parse 1000 16-byte frames', bench_parse(size=16, count=1000), 1000)
+        run(
+            'parse 10 1 MiB frames (64 KiB segments)',
+            bench_parse(size=1 << 20, count=10, segment=1 << 16), 20
+        )
+
+        run_async(
+            'replay 1000 16-byte frames (7-byte segments)', loop,
+            bench_replay(loop, make_capture(size=16, count=1000, segment=7)), 20
+        )
+
+        # A capture recorded with TrafficCapture can be replayed with bench.py <path>
+        for path in sys.argv[1:]:
+            with open(path, 'rb') as fp:
+                run_async(f'replay {path}', loop, bench_replay(loop, fp.read()), 5)
+
+        for count in (10000, 50000, 100000):
+            bench_timers(loop, count)
+
+        for quantum in (1 << 14, 1 << 30):
+            bench_mux(loop, quantum=quantum)
+
+        measure_idle(loop, 10000)
+    finally:
+        loop.close()
+
+    implementations = get_loop_implementations()
+    if 'uvloop' not in implementations:
+        print('socket benchmarks: uvloop is not installed, only asyncio is measured')
+
+    for implementation in implementations:
+        for buffered in (False, True):
+            bench_socket(implementation, buffered=buffered)
+
+
+if __name__ == '__main__':
+    main()
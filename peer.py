@@ -0,0 +1,58 @@
+"""The server side of the in-process connections used by bench.py and test.py."""
+import asyncio
+
+from wsaio.connection import WebSocketConnection
+from wsaio.util import genacckey
+
+
+def make_response(seckey):
+    return (
+        b'HTTP/1.1 101 Switching Protocols\r\n'
+        b'Upgrade: websocket\r\n'
+        b'Connection: Upgrade\r\n'
+        b'Sec-WebSocket-Accept: ' + genacckey(seckey).encode('utf-8') + b'\r\n'
+        b'\r\n'
+    )
+
+
+class PeerProtocol(asyncio.Protocol):
+    """A server that accepts the handshake and parses the client's frames
+    with an unmasked connection in 'bytes' mode.
+
+    Subclasses handle the request path in `handle_handshake` and the
+    parsed events in `handle_events`.
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connection = None
+        self.head = bytearray()
+
+    def data_received(self, data):
+        if self.connection is None:
+            self.head.extend(data)
+
+            index = self.head.find(b'\r\n\r\n')
+            if index == -1:
+                return
+
+            lines = bytes(self.head[:index]).split(b'\r\n')
+            data = bytes(self.head[index + 4:])
+
+            seckey = next(
+                line.split(b':', 1)[1].strip() for line in lines
+                if line.lower().startswith(b'sec-websocket-key:')
+            )
+            self.transport.write(make_response(seckey))
+
+            self.connection = WebSocketConnection(mask=False, text_mode='bytes')
+            self.handle_handshake(lines[0].split(b' ')[1].decode('utf-8'))
+
+        self.connection.receive_data(data)
+        self.handle_events(self.connection.events())
+
+    def handle_handshake(self, path):
+        pass
+
+    def handle_events(self, events):
+        raise NotImplementedError
@@ -1,33 +1,465 @@
+"""An offline conformance and performance suite for the client.
+
+Every case connects a real client to a peer that runs in the same process,
+the peer feeds the case's frames to the client split into segments of a
+fixed size and checks what the client delivers and what it sends back.
+The elapsed time of each case is recorded, so a run can be saved as a
+baseline and later runs compared against it.
+
+    python test.py [--save baseline.json] [--compare baseline.json]
+"""
+import argparse
 import asyncio
+import json
+import sys
+import time
 
+from wsaio import frame as wsframe
 from wsaio.client import WebSocketClient
+from wsaio.connection import (
+    FIN,
+    CloseEvent,
+    PingEvent,
+    PongEvent,
+    encode_header,
+)
+
+from peer import PeerProtocol
+
+SEGMENTS = (
+    ('1-byte', 1),
+    ('7-byte', 7),
+    ('1460-byte', 1460),
+    ('giant', None),
+)
+
+CASE_TIMEOUT = 5
+
+# Totals of groups with less data mostly measure round trips, not throughput
+MIN_COMPARED_SIZE = 1 << 16
+
+
+def frame(op, data=b'', *, fin=True, rsv=0):
+    """Encodes an unmasked frame."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    head = (FIN if fin else 0) | rsv | op
+    return bytes(encode_header(head, len(data))) + data
+
+
+def close_frame(code=None, reason=b''):
+    if code is None:
+        return frame(wsframe.OP_CLOSE)
+    return frame(wsframe.OP_CLOSE, code.to_bytes(2, 'big') + reason)
+
+
+class Case:
+    """A conformance case.
+
+    Arguments:
+        group (str): The group the case belongs to.
+
+        name (str): The name of the case.
+
+        frames (Iterable[bytes]): The frames the peer sends.
+
+        received (list[tuple]): The callbacks the client should receive,
+            e.g. ('text', 'data') or ('close', 1000, 'reason').
+
+        sent (list[tuple]): The frames, other than close, the client
+            should send back, e.g. ('pong', b'data').
+
+        close (Optional[int]): The code of the close frame the client should
+            send, 1005 for a close frame without a code, or None if it should
+            stay open until the suite closes it.
+    """
+
+    def __init__(self, group, name, frames, *, received=(), sent=(), close=None):
+        self.group = group
+        self.name = name
+        self.data = b''.join(frames)
+        self.received = list(received)
+        self.sent = list(sent)
+        self.close = close
+
+    @property
+    def id(self):
+        return f'{self.group}: {self.name}'
+
+
+def get_cases():
+    cases = []
+
+    def case(*args, **kwargs):
+        cases.append(Case(*args, **kwargs))
+
+    text, binary = wsframe.OP_TEXT, wsframe.OP_BINARY
+    cont = wsframe.OP_CONTINUATION
+    ping, pong = wsframe.OP_PING, wsframe.OP_PONG
+
+    for length in (0, 125, 126, 65535, 65536):
+        case('framing', f'text {length} bytes', [frame(text, 'x' * length)],
+             received=[('text', 'x' * length)])
+        case('framing', f'binary {length} bytes', [frame(binary, b'\xfe' * length)],
+             received=[('binary', b'\xfe' * length)])
 
+    case('framing', 'binary 256 KiB', [frame(binary, b'x' * (1 << 18))],
+         received=[('binary', b'x' * (1 << 18))])
+    case('framing', '1000 small messages', [frame(text, str(i)) for i in range(1000)],
+         received=[('text', str(i)) for i in range(1000)])
+    case('framing', 'reserved bits', [frame(text, 'x', rsv=0x40)], close=1002)
+    case('framing', 'reserved data opcode', [frame(0x3)], close=1002)
+    case('framing', 'reserved control opcode', [frame(0xB)], close=1002)
+    case('framing', 'messages before an invalid frame',
+         [frame(text, 'a'), frame(binary, b'b'), frame(0x3)],
+         received=[('text', 'a'), ('binary', b'b')], close=1002)
+
+    case('fragmentation', 'text in 3 fragments',
+         [frame(text, 'ab', fin=False), frame(cont, 'cd', fin=False), frame(cont, 'ef')],
+         received=[('text', 'abcdef')])
+    case('fragmentation', 'binary in 100 fragments',
+         [frame(binary, b'\x00', fin=False)]
+         + [frame(cont, bytes([i]), fin=False) for i in range(1, 99)]
+         + [frame(cont, b'\x63')],
+         received=[('binary', bytes(range(100)))])
+    case('fragmentation', 'empty fragments',
+         [frame(text, '', fin=False), frame(cont, '', fin=False), frame(cont, '')],
+         received=[('text', '')])
+    case('fragmentation', 'ping between fragments',
+         [frame(text, 'ab', fin=False), frame(ping, b'p'), frame(cont, 'cd')],
+         received=[('ping', b'p'), ('text', 'abcd')], sent=[('pong', b'p')])
+    case('fragmentation', 'pong between fragments',
+         [frame(binary, b'ab', fin=False), frame(pong, b'p'), frame(cont, b'cd')],
+         received=[('pong', b'p'), ('binary', b'abcd')])
+    case('fragmentation', 'continuation without a message', [frame(cont, 'x')], close=1002)
+    case('fragmentation', 'new message during a fragmented message',
+         [frame(text, 'a', fin=False), frame(text, 'b')], close=1002)
+    case('fragmentation', 'fragmented ping', [frame(ping, b'p', fin=False)], close=1002)
+    case('fragmentation', 'fragmented close', [frame(wsframe.OP_CLOSE, fin=False)], close=1002)
+
+    valid = 'κόσμε 𝄞 \u0000 ￿'
+    case('utf-8', 'valid multibyte text', [frame(text, valid)], received=[('text', valid)])
+
+    encoded = valid.encode('utf-8')
+    case('utf-8', 'valid text split mid-character',
+         [frame(text, encoded[:2], fin=False), frame(cont, encoded[2:9], fin=False),
+          frame(cont, encoded[9:])],
+         received=[('text', valid)])
+
+    for name, data in (
+        ('truncated sequence', b'\xce\xba\xe1\xbd'),
+        ('lone continuation byte', b'\x80'),
+        ('overlong encoding', b'\xc0\xaf'),
+        ('surrogate', b'\xed\xa0\x80'),
+        ('above U+10FFFF', b'\xf4\x90\x80\x80'),
+        ('invalid byte', b'\xff'),
+    ):
+        case('utf-8', name, [frame(text, b'ok' + data)], close=1007)
+
+    case('utf-8', 'invalid in the first fragment',
+         [frame(text, b'\xff', fin=False), frame(cont, b'ok')], close=1007)
+    case('utf-8', 'invalid in the last fragment',
+         [frame(text, b'ok', fin=False), frame(cont, b'\xed\xa0\x80')], close=1007)
+    case('utf-8', 'binary is not validated', [frame(binary, b'\xff\xfe')],
+         received=[('binary', b'\xff\xfe')])
+
+    case('control', 'ping without payload', [frame(ping)],
+         received=[('ping', b'')], sent=[('pong', b'')])
+    case('control', 'ping with 125 bytes', [frame(ping, b'x' * 125)],
+         received=[('ping', b'x' * 125)], sent=[('pong', b'x' * 125)])
+    case('control', 'ping with 126 bytes', [frame(ping, b'x' * 126)], close=1002)
+    case('control', 'unsolicited pong', [frame(pong, b'u')], received=[('pong', b'u')])
+    case('control', '10 pings', [frame(ping, bytes([i])) for i in range(10)],
+         received=[('ping', bytes([i])) for i in range(10)],
+         sent=[('pong', bytes([i])) for i in range(10)])
+    case('control', 'ping between messages',
+         [frame(text, 'a'), frame(ping, b'p'), frame(text, 'b')],
+         received=[('text', 'a'), ('ping', b'p'), ('text', 'b')], sent=[('pong', b'p')])
+
+    for code in (1000, 1001, 1002, 1003, 1007, 1008, 1009, 1010, 1011, 3000, 4999):
+        case('close', f'code {code}', [close_frame(code)],
+             received=[('close', code, '')], close=code)
+
+    case('close', 'code and reason', [close_frame(1000, 'bye'.encode('utf-8'))],
+         received=[('close', 1000, 'bye')], close=1000)
+    case('close', 'no payload', [close_frame()], received=[('close', None, '')],
+         close=wsframe.WS_NO_STATUS_RECEIVED)
+    case('close', 'one byte payload', [frame(wsframe.OP_CLOSE, b'\x03')], close=1002)
+
+    for code in (0, 999, 1004, 1005, 1006, 1015, 1016, 2999, 5000):
+        case('close', f'invalid code {code}', [close_frame(code)], close=1002)
+
+    case('close', 'invalid UTF-8 reason', [close_frame(1000, b'\xff')], close=1007)
+    case('close', 'reason with 123 bytes', [close_frame(1000, b'r' * 123)],
+         received=[('close', 1000, 'r' * 123)], close=1000)
+    case('close', 'messages before close', [frame(text, 'a'), close_frame(1000)],
+         received=[('text', 'a'), ('close', 1000, '')], close=1000)
+
+    return cases
+
+
+class RecordingClient(WebSocketClient):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.record = []
+        self.opened = self.loop.create_future()
+
+    async def on_open(self):
+        self.opened.set_result(None)
 
-class TestClient(WebSocketClient):
     async def on_text(self, data):
-        await self.write(data)
+        self.record.append(('text', data))
 
     async def on_binary(self, data):
-        await self.write(data, binary=True)
+        self.record.append(('binary', data))
+
+    async def on_ping(self, data):
+        self.record.append(('ping', data))
+
+    async def on_pong(self, data):
+        self.record.append(('pong', data))
+
+    async def on_close(self, code, data):
+        self.record.append(('close', code, data))
+
+
+class RecordingPeer(PeerProtocol):
+    """The server side of a case, it records the frames the client sends.
+    The transport is closed once the client sends a close frame, the
+    closing handshake is otherwise left to the case.
+    """
+
+    def __init__(self, peers):
+        peers.append(self)
+
+        self.sent = []
+        self.close_code = None
+        self.closed = False
+
+    def handle_events(self, events):
+        for event in events:
+            if isinstance(event, CloseEvent):
+                if event.code is None:
+                    self.close_code = wsframe.WS_NO_STATUS_RECEIVED
+                else:
+                    self.close_code = event.code
+                self.closed = True
+                self.transport.close()
+                return
+            elif isinstance(event, PingEvent):
+                self.sent.append(('ping', event.data))
+            elif isinstance(event, PongEvent):
+                self.sent.append(('pong', event.data))
+            else:
+                self.sent.append(('data', event.data))
+
+    def connection_lost(self, exc):
+        self.closed = True
+
+
+def feed(protocol, data, segment):
+    """Feeds data to a protocol the way the event loop does, in segments of
+    at most segment bytes. The data isn't sent through the socket, where the
+    kernel would coalesce the segments.
+    """
+    if segment is None:
+        segment = len(data)
 
+    with memoryview(data) as view:
+        for start in range(0, len(data), segment):
+            chunk = view[start:start + segment]
+
+            if isinstance(protocol, asyncio.BufferedProtocol):
+                while chunk:
+                    buffer = protocol.get_buffer(len(chunk))
+                    size = min(len(buffer), len(chunk))
+
+                    buffer[:size] = chunk[:size]
+                    protocol.buffer_updated(size)
+
+                    chunk = chunk[size:]
+            else:
+                protocol.data_received(bytes(chunk))
+
+
+async def wait_for(condition):
+    deadline = time.perf_counter() + CASE_TIMEOUT
+
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0)
+
+    return True
+
+
+async def run_case(loop, url, peers, case, segment, buffered):
+    """Runs a case and returns a list of failures and the elapsed time."""
+    client = RecordingClient(loop=loop, close_timeout=1)
+    await client.connect(url, buffered=buffered)
+    await client.opened
+
+    peer = peers.pop()
+
+    start = time.perf_counter()
+    feed(client.stream.protocol, case.data, segment)
+
+    done = await wait_for(
+        lambda: len(client.record) >= len(case.received)
+        and len(peer.sent) >= len(case.sent)
+        and (case.close is None or peer.closed)
+    )
+
+    elapsed = time.perf_counter() - start
+
+    failures = []
+    if not done:
+        failures.append('timed out')
+
+    if client.record != case.received:
+        failures.append(f'received {summarize(client.record)}, expected {summarize(case.received)}')
+
+    if peer.sent != case.sent:
+        failures.append(f'sent {summarize(peer.sent)}, expected {summarize(case.sent)}')
+
+    if case.close is not None and peer.close_code != case.close:
+        failures.append(f'closed with {peer.close_code}, expected {case.close}')
+
+    if not client.stream.is_closing() and client.is_opened():
+        await client.close()
+
+    client.stream.close()
+    await client.wait_until_closed()
+
+    return failures, elapsed
+
+
+def summarize(record):
+    items = []
+    for item in record[:4]:
+        item = tuple(
+            value[:20] + (b'...' if isinstance(value, bytes) else '...')
+            if isinstance(value, (str, bytes)) and len(value) > 20 else value
+            for value in item
+        )
+        items.append(repr(item))
+
+    if len(record) > 4:
+        items.append(f'... {len(record) - 4} more')
+
+    return '[' + ', '.join(items) + ']'
+
+
+async def run_suite(loop, cases, modes, repeat):
+    peers = []
+    server = await loop.create_server(lambda: RecordingPeer(peers), '127.0.0.1', 0)
+    url = f'ws://127.0.0.1:{server.sockets[0].getsockname()[1]}/'
+
+    results = {}
+    failed = 0
 
-async def main(loop):
     try:
-        for i in range(1, 302):
-            print(f'Running test case {i}')
-            client = TestClient(loop=loop)
-            await client.connect(f'ws://localhost:9001/runCase?case={i}&agent=wsaio')
-
-            try:
-                await asyncio.wait_for(client.stream.wait_until_closed(), timeout=10)
-            except asyncio.TimeoutError:
-                print(f'Test case {i} timed out')
-                client.stream.close()
-                break
+        for buffered in modes:
+            mode = 'buffered' if buffered else 'data_received'
+
+            for segment_name, segment in SEGMENTS:
+                totals = {}
+
+                for case in cases:
+                    # The fastest run is the least disturbed by the rest of the system
+                    elapsed = float('inf')
+                    for _ in range(repeat):
+                        failures, run_elapsed = await run_case(
+                            loop, url, peers, case, segment, buffered
+                        )
+                        elapsed = min(elapsed, run_elapsed)
+
+                        if failures:
+                            break
+
+                    results[f'{case.id} [{segment_name}, {mode}]'] = len(case.data) / elapsed
+
+                    # Totals are kept per group, so runs of some groups compare like for like
+                    size, total = totals.get(case.group, (0, 0))
+                    totals[case.group] = (size + len(case.data), total + elapsed)
+
+                    for failure in failures:
+                        failed += 1
+                        print(f'FAIL {case.id} [{segment_name}, {mode}]: {failure}')
+
+                for group, (size, elapsed) in totals.items():
+                    if size >= MIN_COMPARED_SIZE:
+                        results[f'total {group} [{segment_name}, {mode}]'] = size / elapsed
+
+                size = sum(size for size, _ in totals.values())
+                elapsed = sum(elapsed for _, elapsed in totals.values())
+                print(
+                    f'{len(cases)} cases ({segment_name} segments, {mode}): '
+                    f'{size / elapsed / 1e6:,.1f} MB/sec'
+                )
     finally:
-        client = TestClient(loop=loop)
-        await client.connect('ws://localhost:9001/updateReports?agent=wsaio')
+        server.close()
+        await server.wait_closed()
+
+    return results, failed
+
+
+def compare(results, baseline, tolerance):
+    """Returns the group totals that are slower than the baseline by more than the
+    tolerance, groups with less than MIN_COMPARED_SIZE bytes of data have no total.
+    """
+    regressions = []
+
+    for key, throughput in results.items():
+        expected = baseline.get(key)
+        if key.startswith('total') and expected and throughput < expected * (1 - tolerance):
+            regressions.append(f'{key}: {throughput / 1e6:,.1f} MB/sec, '
+                               f'baseline {expected / 1e6:,.1f} MB/sec')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--save', help='save the throughput of each case to a JSON file')
+    parser.add_argument('--compare', help='compare the totals to a saved JSON file')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.4,
+        help='the fraction a total may be slower than the baseline (default: 0.4)'
+    )
+    parser.add_argument('--group', action='append', help='only run the cases of a group')
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='the number of runs of each case, the fastest is recorded (default: 3)'
+    )
+    args = parser.parse_args()
+
+    cases = [case for case in get_cases() if not args.group or case.group in args.group]
+
+    loop = asyncio.new_event_loop()
+    try:
+        results, failed = loop.run_until_complete(
+            run_suite(loop, cases, (False, True), args.repeat)
+        )
+    finally:
+        loop.close()
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+
+    print(f'{failed} failures, {len(regressions)} regressions')
+    return 1 if failed or regressions else 0
 
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(main(loop))
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,24 @@
+from .capture import (
+    TrafficCapture,
+    read_capture,
+    replay,
+)
 from .client import WebSocketClient
+from .codec import (
+    JSONCodec,
+    MessageCodec,
+    MsgpackCodec,
+    ORJSONCodec,
+)
+from .connection import (
+    BinaryEvent,
+    CloseEvent,
+    PingEvent,
+    PongEvent,
+    TextEvent,
+    WebSocketConnection,
+    WebSocketEvent,
+)
 from .exceptions import (
     HandshakeFailureError,
     InvalidDataError,
@@ -19,3 +39,28 @@ from .frame import (
     WS_UNSUPPORTED_DATA,
     WebSocketFrame
 )
+from .loops import (
+    get_loop_implementations,
+    is_uvloop,
+    new_event_loop,
+)
+from .monitor import LoopMonitor
+from .mux import (
+    Channel,
+    Multiplexer,
+)
+from .offload import OffloadPolicy
+from .pubsub import (
+    PubSub,
+    PubSubBus,
+)
+from .rpc import (
+    LatencyHistogram,
+    RPCManager,
+)
+from .sockopts import SocketOptions
+from .timer import (
+    TimerWheel,
+    WheelTimer,
+    get_timer_wheel,
+)
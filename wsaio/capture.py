@@ -0,0 +1,141 @@
+import asyncio
+import os
+import struct
+import time
+
+CAPTURE_MAGIC = b'WSAIOCAP\x01'
+
+_RECORD = struct.Struct('<QI')
+
+_INVALID_CAPTURE_MSG = 'The file is not a wsaio capture'
+_TRUNCATED_CAPTURE_MSG = 'The capture ended in the middle of a record'
+
+
+class TrafficCapture:
+    """A recorder for the raw data received by a stream.
+
+    Every chunk is recorded exactly as it was passed to `data_received`,
+    so the segmentation of the original traffic is preserved. The file
+    starts with `CAPTURE_MAGIC`, followed by a record for each chunk: the
+    nanoseconds since the capture started and the chunk's length as
+    little-endian unsigned 64 and 32 bit integers, then the chunk itself.
+
+    Records are written from the event loop, so the file should be a
+    buffered file on a local disk.
+
+    Arguments:
+        file (str | os.PathLike | BinaryIO): The path of the capture or a
+            binary file opened for writing, a path is opened and closed by
+            the capture.
+
+    Attributes:
+        chunks (int): The number of chunks recorded.
+
+        size (int): The number of bytes recorded.
+    """
+
+    def __init__(self, file):
+        if isinstance(file, (str, os.PathLike)):
+            self.file = open(file, 'wb')
+            self._owns_file = True
+        else:
+            self.file = file
+            self._owns_file = False
+
+        self.file.write(CAPTURE_MAGIC)
+
+        self.chunks = 0
+        self.size = 0
+
+        self._start = time.monotonic_ns()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} chunks={self.chunks} size={self.size}>'
+
+    def record(self, data):
+        self.file.write(_RECORD.pack(time.monotonic_ns() - self._start, len(data)))
+        self.file.write(data)
+
+        self.chunks += 1
+        self.size += len(data)
+
+    def close(self):
+        if self._owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+def read_capture(file):
+    """Reads the chunks of a capture.
+
+    Arguments:
+        file (str | os.PathLike | BinaryIO): The path of the capture or a
+            binary file opened for reading.
+
+    Returns:
+        Iterator[tuple[float, bytes]]: The seconds since the capture
+            started and the data of each chunk.
+
+    Raises:
+        ValueError: The file is not a capture or is truncated.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as fp:
+            yield from read_capture(fp)
+        return
+
+    if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+        raise ValueError(_INVALID_CAPTURE_MSG)
+
+    while True:
+        record = file.read(_RECORD.size)
+        if not record:
+            return
+
+        if len(record) != _RECORD.size:
+            raise ValueError(_TRUNCATED_CAPTURE_MSG)
+
+        timestamp, length = _RECORD.unpack(record)
+
+        data = file.read(length)
+        if len(data) != length:
+            raise ValueError(_TRUNCATED_CAPTURE_MSG)
+
+        yield timestamp / 1e9, data
+
+
+async def replay(file, stream, *, speed=None):
+    """Feeds a capture into a stream's parser with the original segmentation.
+
+    The parser is usually a reader's `read_frame`, which delivers the
+    replayed messages to its callbacks as if they arrived from a peer.
+
+    Arguments:
+        file (str | os.PathLike | BinaryIO): The capture to replay.
+
+        stream (Stream): The stream whose parser receives the chunks.
+
+        speed (Optional[float]): The speed relative to the original timing,
+            e.g. 1.0 for the original speed, None replays as fast as possible.
+
+    Returns:
+        int: The number of chunks replayed.
+    """
+    loop = stream.loop
+    start = loop.time()
+    chunks = 0
+
+    for timestamp, data in read_capture(file):
+        if speed is not None:
+            delay = start + timestamp / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        stream._ctx.feed_data(data)
+        chunks += 1
+
+        # Let the tasks of the delivered messages run between chunks
+        await asyncio.sleep(0)
+
+    return chunks
@@ -1,25 +1,56 @@
 import asyncio
 
 from . import frame as wsframe
-from .exceptions import HandshakeFailureError, InvalidFrameError
+from .connection import WebSocketConnection
+from .exceptions import InvalidFrameError
 from .handshake import WebSocketHandshake
 from .reader import WebSocketReader
+from .timer import get_timer_wheel
 from .writer import WebSocketWriter
 
+_RPC_CODEC_MSG = (
+    'An RPC manager with the default get_id and set_id needs a codec to encode its dicts'
+)
+
 
 class WebSocketClient:
-    def __init__(self, *, loop=None):
+    # The number of connections, across all clients, that completed the
+    # closing handshake and that had to be torn down without it
+    clean_closes = 0
+    aborted_closes = 0
+
+    def __init__(
+        self, *, loop=None, text_mode='str', validate_utf8=True, codec=None, offload=None,
+        monitor=None, close_timeout=10, max_frame_size=None, rpc=None, multiplexer=None
+    ):
+        if rpc is not None and codec is None and rpc.uses_dicts():
+            raise ValueError(_RPC_CODEC_MSG)
+
         if loop is not None:
             self.loop = loop
         else:
             self.loop = asyncio.get_event_loop()
 
         self.stream = None
+        self.connection = None
         self.reader = None
         self.writer = None
 
+        self.text_mode = text_mode
+        self.validate_utf8 = validate_utf8
+
+        self.codec = codec
+        self.offload = offload
+        self.monitor = monitor
+        self.close_timeout = close_timeout
+        self.max_frame_size = max_frame_size
+        self.rpc = rpc
+        self.multiplexer = multiplexer
+
         self._opened = False
         self._closing = False
+        self._close_received = False
+        self._monitoring = False
 
     def is_opened(self):
         return self._opened
@@ -33,22 +64,83 @@ class WebSocketClient:
         await self.on_ping(data)
 
     async def _close_hook(self, code, data):
+        self._close_received = True
+
         if not self._closing:
-            await self.close(code=code)
+            # The peer started the closing handshake, echo it and close the stream
+            self._closing = True
+            await self._send_close(code=code)
+
+            self.stream.close()
+            await self._wait_closed(self.close_timeout)
+        else:
+            # The peer echoed our close, the task in close() waits for the stream
+            self.stream.close()
 
-        self.stream.close()
         self._opened = False
 
         await self.on_close(code, data)
 
     async def _error_hook(self, exc):
+        if self._closing:
+            self.stream.close()
+            return
+
         if not self.is_opened():
             raise exc
 
+        self._closing = True
+
         if isinstance(exc, InvalidFrameError):
-            await self.close(exc.message, code=exc.code)
+            await self._send_close(exc.message, code=exc.code)
+
+        self.stream.close()
+        await self._wait_closed(self.close_timeout)
+
+    async def _send_close(self, data=None, *, code):
+        if self.stream.is_closing():
+            return
+
+        try:
+            await self.writer.close(data, code=code, mask=True)
+        except ConnectionError:
+            pass
+
+    async def _wait_closed(self, timeout):
+        # The peer isn't reading or closing if this expires, don't keep the socket around for it
+        if timeout is not None:
+            timer = get_timer_wheel(self.loop).call_later(timeout, self.stream.abort)
         else:
-            self.stream.close()
+            timer = None
+
+        clean = False
+
+        try:
+            await asyncio.shield(self.stream.wait_until_closed())
+            clean = self._close_received and (timer is None or not timer.expired())
+        except ConnectionError:
+            pass
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+            # Everything waiting on the connection is released however the wait ended
+            self._opened = False
+
+            if self._monitoring:
+                self._monitoring = False
+                self.monitor.release()
+
+            if self.rpc is not None:
+                self.rpc.fail_all(ConnectionResetError('The WebSocket was closed'))
+
+            if self.multiplexer is not None:
+                self.multiplexer.fail_all(ConnectionResetError('The WebSocket was closed'))
+
+            if clean:
+                WebSocketClient.clean_closes += 1
+            else:
+                WebSocketClient.aborted_closes += 1
 
     async def on_open(self):
         pass
@@ -65,6 +157,9 @@ class WebSocketClient:
     async def on_binary(self, data):
         pass
 
+    async def on_message(self, obj):
+        pass
+
     async def on_close(self, code, data):
         pass
 
@@ -86,7 +181,68 @@ class WebSocketClient:
 
         await self.writer.write(data, binary=binary, mask=True)
 
-    async def close(self, data=None, *, code=wsframe.WS_NORMAL_CLOSURE):
+    async def send_obj(self, obj):
+        if self.codec is None:
+            raise RuntimeError('The WebSocket has no codec')
+
+        await self.write(self.codec.encode(obj), binary=self.codec.binary)
+
+    async def call(self, payload, *, timeout=None):
+        """Sends a call and waits for the reply with the same correlation ID.
+
+        Arguments:
+            payload (Any): The payload of the call, it is encoded by the codec
+                if the client has one.
+
+            timeout (Optional[float]): The timeout, defaults to the RPC manager's.
+
+        Returns:
+            Any: The reply, decoded by the codec if the client has one.
+
+        Raises:
+            asyncio.TimeoutError: No reply was received in time.
+
+            ConnectionError: The WebSocket was closed before the reply was received.
+        """
+        if self.rpc is None:
+            raise RuntimeError('The WebSocket has no RPC manager')
+
+        return await self.rpc.call(self.loop, self._send_call, payload, timeout=timeout)
+
+    async def _send_call(self, message):
+        if self.codec is not None:
+            await self.send_obj(message)
+        else:
+            await self.write(message, binary=not isinstance(message, str))
+
+    def _rpc_hook(self, callback):
+        async def hook(data):
+            if not self.rpc.resolve(data):
+                await callback(data)
+
+        return hook
+
+    async def _mux_hook(self, data):
+        try:
+            self.multiplexer.feed(data)
+        except InvalidFrameError as exc:
+            await self._error_hook(exc)
+
+    async def close(self, data=None, *, code=wsframe.WS_NORMAL_CLOSURE, timeout=None):
+        """Performs the closing handshake.
+
+        The close frame is sent and the stream is closed once the peer echoes
+        it, the stream is aborted if that doesn't happen within the timeout.
+
+        Arguments:
+            data (Optional[str | int | BytesLike]): The close reason.
+
+            code (int): The close code.
+
+            timeout (Optional[float]): The maximum time to wait for the peer,
+                defaults to the client's close_timeout, which waits
+                indefinitely if it is None.
+        """
         if not self.is_opened():
             raise RuntimeError('The WebSocket is not opened')
 
@@ -94,19 +250,73 @@ class WebSocketClient:
             raise RuntimeError('The WebSocket cannot be closed more than once')
 
         self._closing = True
-        await self.writer.close(data, code=code, mask=True)
+        await self._send_close(data, code=code)
+
+        await self._wait_closed(self.close_timeout if timeout is None else timeout)
+
+    @classmethod
+    def get_close_stats(cls):
+        return {
+            'clean_closes': cls.clean_closes,
+            'aborted_closes': cls.aborted_closes,
+        }
+
+    async def connect(
+        self, url, *, timeout=30, capture=None, socket_options=None, buffered=None, **kwargs
+    ):
+        """Connects to a WebSocket server and performs the handshake.
+
+        Arguments:
+            url (str): The URL of the server.
+
+            timeout (Optional[float]): The timeout for the handshake, None
+                waits indefinitely.
+
+            capture (Optional[TrafficCapture]): A capture that records the
+                data received after the handshake.
 
-    async def connect(self, url, *, timeout=30, **kwargs):
-        handshake = await WebSocketHandshake.from_url(url, loop=self.loop, **kwargs)
+            socket_options (Optional[SocketOptions]): Options that are
+                applied to the socket before it connects.
+
+            buffered (Optional[bool]): Whether the event loop reads into a
+                shared receive buffer rather than allocating for every read,
+                defaults to True under uvloop.
+
+            **kwargs: Passed to `loop.create_connection`.
+        """
+        handshake = await WebSocketHandshake.from_url(
+            url, loop=self.loop, socket_options=socket_options, buffered=buffered, **kwargs
+        )
 
         try:
             self.stream = await handshake.negotiate(timeout=timeout)
-        except HandshakeFailureError:
+        except BaseException:
+            # The socket isn't used if the handshake didn't complete, e.g. it was cancelled
             handshake.shutdown()
             raise
         else:
-            self.reader = WebSocketReader(stream=self.stream)
-            self.writer = WebSocketWriter(stream=self.stream)
+            text_mode = self.text_mode
+            if self.codec is not None and not self.codec.binary:
+                text_mode = 'bytes'
+
+            self.connection = WebSocketConnection(
+                mask=True,
+                text_mode=text_mode,
+                validate_utf8=self.validate_utf8,
+                decode_text=self.offload is None,
+                max_frame_size=self.max_frame_size,
+            )
+
+            self.reader = WebSocketReader(
+                stream=self.stream,
+                connection=self.connection,
+                codec=self.codec,
+                offload=self.offload,
+                monitor=self.monitor,
+            )
+            self.writer = WebSocketWriter(
+                stream=self.stream, connection=self.connection, offload=self.offload
+            )
 
             self.reader._on_ping = self._ping_hook
             self.reader._on_pong = self.on_pong
@@ -114,8 +324,30 @@ class WebSocketClient:
             self.reader._on_binary = self.on_binary
             self.reader._on_close = self._close_hook
 
+            if self.codec is not None:
+                if self.codec.binary:
+                    self.reader._on_binary = self.on_message
+                else:
+                    self.reader._on_text = self.on_message
+
+            if self.multiplexer is not None:
+                # Binary messages carry the channels, text messages are delivered as usual
+                self.multiplexer.attach(self.writer)
+                self.reader._on_binary = self._mux_hook
+
+            if self.rpc is not None:
+                self.reader._on_text = self._rpc_hook(self.reader._on_text)
+                self.reader._on_binary = self._rpc_hook(self.reader._on_binary)
+
+            if self.monitor is not None and not self._monitoring:
+                self._monitoring = True
+                self.monitor.acquire(self.loop)
+
             self.loop.create_task(self._open_hook())
 
+            if capture is not None:
+                self.stream.set_capture(capture)
+
             self.stream.set_error_handler(self._error_hook)
             self.stream.set_parser(self.reader.read_frame)
 
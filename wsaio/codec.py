@@ -0,0 +1,92 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class MessageCodec:
+    """The base class for message codecs.
+
+    A codec converts between Python objects and WebSocket message payloads,
+    subclasses should implement `encode` and `decode` and set `binary` if
+    messages should be sent with the binary opcode.
+    """
+
+    binary = False
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} binary={self.binary}>'
+
+    def encode(self, obj):
+        """Encodes an object into a message payload.
+
+        Arguments:
+            obj (Any): The object to encode.
+
+        Returns:
+            bytes: The payload, UTF-8 for text codecs.
+        """
+        raise NotImplementedError
+
+    def decode(self, data):
+        """Decodes a message payload into an object.
+
+        Arguments:
+            data (bytes): The payload to decode.
+
+        Raises:
+            ValueError: The payload could not be decoded.
+        """
+        raise NotImplementedError
+
+
+class JSONCodec(MessageCodec):
+    """A text codec backed by the standard library json module."""
+
+    def __init__(self, *, separators=(',', ':'), **kwargs):
+        self._encoder = json.JSONEncoder(separators=separators, **kwargs)
+
+    def encode(self, obj):
+        return self._encoder.encode(obj).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class ORJSONCodec(MessageCodec):
+    """A text codec backed by orjson, which must be installed."""
+
+    def __init__(self, *, option=None):
+        if orjson is None:
+            raise RuntimeError('ORJSONCodec requires orjson to be installed')
+
+        self.option = option
+
+    def encode(self, obj):
+        return orjson.dumps(obj, option=self.option)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec(MessageCodec):
+    """A binary codec backed by msgpack, which must be installed."""
+
+    binary = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError('MsgpackCodec requires msgpack to be installed')
+
+    def encode(self, obj):
+        return msgpack.packb(obj)
+
+    def decode(self, data):
+        return msgpack.unpackb(data)
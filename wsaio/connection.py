@@ -0,0 +1,580 @@
+from codecs import getincrementaldecoder
+from io import BytesIO, StringIO
+
+from . import frame as wsframe
+from . import util
+from .exceptions import InvalidFrameError
+
+_INVALID_OPCODE_MSG = 'The WebSocket received a frame with an invalid or unknown opcode: {!r}'
+_MISSING_CLOSE_CODE_MSG = 'The WebSocket received a close frame with payload data but no close code'
+_INVALID_CLOSE_CODE_MSG = (
+    'The WebSocket received a close frame with an invalid or unknown close code: {!r}'
+)
+
+_LARGE_CONTROL_MSG = (
+    'The WebSocket received a control frame with a payload length that exceeds 125: {!r}'
+)
+
+_FRAGMENTED_CONTROL_MSG = 'The WebSocket received a fragmented control frame'
+_MEANINGLESS_RSV_BITS_MSG = (
+    'The WebSocket received a frame with a reserved bit set but no meaning was negotiated'
+)
+_NON_UTF_8_MSG = 'The WebSocket received a text or close frame with non-UTF-8 payload data'
+
+_EXPECTED_CONT_MSG = (
+    'The WebSocket received a non-continuation data frame while reading a fragmented frame'
+)
+_UNEXPECTED_CONT_MSG = (
+    'The WebSocket received a continuation frame but no fragmented frame was received'
+)
+
+_INVALID_TEXT_MODE_MSG = 'text_mode should be \'str\' or \'bytes\', got {!r}'
+
+_IncrementalDecoder = getincrementaldecoder('utf-8')
+
+TEXT_MODES = ('str', 'bytes')
+
+FIN = 0x80
+
+VALIDATE_CHUNK_SIZE = 1 << 14
+
+_INCOMPLETE = object()
+
+
+def _describe_head(fbyte):
+    op = fbyte & 0xF
+
+    if op not in wsframe.WS_OPS:
+        return op, _INVALID_OPCODE_MSG.format(op)
+
+    if fbyte & 0x70:
+        return op, _MEANINGLESS_RSV_BITS_MSG
+
+    if op > 0x7 and not fbyte & 0x80:
+        return op, _FRAGMENTED_CONTROL_MSG
+
+    return op, None
+
+
+# The opcode and validation error for every possible first header byte,
+# so that a frame's head is only decoded once.
+_HEADS = tuple(_describe_head(fbyte) for fbyte in range(256))
+
+
+def _feed_validator(decoder, data):
+    # Decoding a chunk at a time keeps only a chunk's worth of str alive
+    with memoryview(data) as view:
+        for start in range(0, len(view), VALIDATE_CHUNK_SIZE):
+            decoder.decode(view[start:start + VALIDATE_CHUNK_SIZE])
+
+
+def validate_utf8(data):
+    """Checks that a byte string is valid UTF-8 without keeping a decoded copy.
+
+    Python has no validate-only UTF-8 API, so non-ASCII data is decoded
+    in chunks of VALIDATE_CHUNK_SIZE bytes and each decoded chunk is
+    dropped right away, the memory used is bounded by the chunk size
+    rather than the payload size.
+
+    Raises:
+        UnicodeDecodeError: The data is not valid UTF-8.
+    """
+    if data.isascii():
+        return
+
+    if len(data) <= VALIDATE_CHUNK_SIZE:
+        data.decode('utf-8')
+        return
+
+    decoder = _IncrementalDecoder()
+    _feed_validator(decoder, data)
+    decoder.decode(b'', final=True)
+
+
+def encode_header(head, length, mask=None):
+    """Encodes the header of a WebSocket frame.
+
+    Arguments:
+        head (int): The first byte of the frame.
+
+        length (int): The payload length.
+
+        mask (Optional[bytes]): The masking key, if the frame is masked.
+    """
+    buffer = bytearray(2)
+    buffer[0] = head
+
+    masked = (mask is not None) << 7
+
+    if length < 126:
+        buffer[1] = masked | length
+    elif length < (1 << 16):
+        buffer[1] = masked | 126
+        buffer.extend(length.to_bytes(2, 'big', signed=False))
+    else:
+        buffer[1] = masked | 127
+        buffer.extend(length.to_bytes(8, 'big', signed=False))
+
+    if mask is not None:
+        buffer.extend(mask)
+
+    return buffer
+
+
+def encode_payload(data, code=None):
+    """Encodes the payload of a frame, including the close code.
+
+    Arguments:
+        data (Optional[str | int | BytesLike]): The data to send in the frame.
+
+        code (Optional[int]): The close code of a close frame.
+    """
+    data = util.getbytes(data)
+
+    if code is not None:
+        data = code.to_bytes(2, 'big', signed=False) + data
+
+    return data
+
+
+class WebSocketEvent:
+    """The base class for events produced by a `WebSocketConnection`."""
+
+    __slots__ = ('data',)
+
+    op = None
+
+    def __init__(self, data):
+        self.data = data
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} data={self.data!r:.40}>'
+
+
+class TextEvent(WebSocketEvent):
+    __slots__ = ()
+
+    op = wsframe.OP_TEXT
+
+
+class BinaryEvent(WebSocketEvent):
+    __slots__ = ()
+
+    op = wsframe.OP_BINARY
+
+
+class PingEvent(WebSocketEvent):
+    __slots__ = ()
+
+    op = wsframe.OP_PING
+
+
+class PongEvent(WebSocketEvent):
+    __slots__ = ()
+
+    op = wsframe.OP_PONG
+
+
+class CloseEvent(WebSocketEvent):
+    __slots__ = ('code',)
+
+    op = wsframe.OP_CLOSE
+
+    def __init__(self, code, data):
+        self.code = code
+        self.data = data
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} code={self.code!r} data={self.data!r:.40}>'
+
+
+class WebSocketConnection:
+    """A WebSocket protocol state machine that does no I/O.
+
+    Received bytes are fed in with `receive_data` and turned into events
+    by `events`, frames to send are encoded into a buffer that is emptied
+    by `data_to_send`.
+
+    Arguments:
+        mask (bool): Whether frames are sent with a mask by default,
+            this should be True for clients.
+
+        text_mode (str): How text payloads are delivered, 'str' decodes them
+            and 'bytes' passes the raw UTF-8 bytes through.
+
+        validate_utf8 (bool): Whether to validate text payloads in 'bytes' mode,
+            this should only be disabled for trusted peers.
+
+        decode_text (bool): Whether to decode or validate text payloads at all,
+            if False they are delivered as raw bytes and the caller is
+            responsible for applying text_mode, e.g. in an executor.
+
+        genmask (Callable[[], bytes]): The function used to generate masking keys.
+
+        max_frame_size (Optional[int]): The maximum payload size of outgoing
+            data frames, larger messages are split into continuation frames.
+    """
+
+    __slots__ = (
+        'mask',
+        'text_mode',
+        'validate_utf8',
+        'decode_text',
+        'genmask',
+        'max_frame_size',
+        '_buffer',
+        '_outgoing',
+        '_fragment_buffer',
+        '_fragment_decoder',
+        '_fragmented_op',
+    )
+
+    def __init__(
+        self, *, mask=False, text_mode='str', validate_utf8=True, decode_text=True,
+        genmask=util.genmask, max_frame_size=None
+    ):
+        if text_mode not in TEXT_MODES:
+            raise ValueError(_INVALID_TEXT_MODE_MSG.format(text_mode))
+
+        if max_frame_size is not None and max_frame_size < 1:
+            raise ValueError('max_frame_size should be a positive integer')
+
+        self.mask = mask
+        self.text_mode = text_mode
+        self.validate_utf8 = validate_utf8
+        self.decode_text = decode_text
+        self.genmask = genmask
+        self.max_frame_size = max_frame_size
+
+        self._buffer = bytearray()
+        self._outgoing = []
+
+        self._fragment_buffer = None
+        self._fragment_decoder = None
+        self._fragmented_op = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} mask={self.mask}>'
+
+    def receive_data(self, data):
+        """Adds received bytes to the buffer, they are parsed by `events`."""
+        self._buffer.extend(data)
+
+    def events(self):
+        """Parses the buffered bytes, yielding an event for each complete message.
+
+        Raises:
+            InvalidFrameError: The peer sent an invalid frame, events for the
+                frames before it are yielded first.
+        """
+        while True:
+            event = self._parse_frame()
+            if event is _INCOMPLETE:
+                return
+
+            if event is not None:
+                yield event
+
+    def _parse_frame(self):
+        buffer = self._buffer
+        size = len(buffer)
+
+        if size < 2:
+            return _INCOMPLETE
+
+        fbyte = buffer[0]
+        sbyte = buffer[1]
+
+        op, error = _HEADS[fbyte]
+        if error is not None:
+            raise InvalidFrameError(error, wsframe.WS_PROTOCOL_ERROR)
+
+        length = sbyte & 0x7F
+        offset = 2
+
+        if op > 0x7:
+            if length > 125:
+                raise InvalidFrameError(
+                    _LARGE_CONTROL_MSG.format(length), wsframe.WS_PROTOCOL_ERROR
+                )
+        elif length == 126:
+            if size < 4:
+                return _INCOMPLETE
+
+            length = int.from_bytes(buffer[2:4], 'big', signed=False)
+            offset = 4
+        elif length == 127:
+            if size < 10:
+                return _INCOMPLETE
+
+            length = int.from_bytes(buffer[2:10], 'big', signed=False)
+            offset = 10
+
+        if sbyte & 0x80:
+            if size < offset + 4:
+                return _INCOMPLETE
+
+            mask = bytes(buffer[offset:offset + 4])
+            offset += 4
+        else:
+            mask = None
+
+        end = offset + length
+        if size < end:
+            return _INCOMPLETE
+
+        with memoryview(buffer) as view:
+            data = view[offset:end].tobytes()
+        del buffer[:end]
+
+        if mask is not None:
+            data = util.mask(data, mask)
+
+        if op == wsframe.OP_CLOSE:
+            return self._handle_close_frame(data)
+        elif op == wsframe.OP_PING:
+            return PingEvent(data)
+        elif op == wsframe.OP_PONG:
+            return PongEvent(data)
+
+        try:
+            return self._handle_data_frame(op, fbyte & 0x80, data)
+        except UnicodeDecodeError:
+            raise InvalidFrameError(_NON_UTF_8_MSG, wsframe.WS_INVALID_PAYLOAD_DATA) from None
+
+    def _handle_close_frame(self, data):
+        if not data:
+            return CloseEvent(None, '')
+        elif len(data) < 2:
+            raise InvalidFrameError(_MISSING_CLOSE_CODE_MSG, wsframe.WS_PROTOCOL_ERROR)
+
+        code = int.from_bytes(data[:2], 'big', signed=False)
+
+        if not wsframe.is_close_code(code):
+            raise InvalidFrameError(_INVALID_CLOSE_CODE_MSG.format(code), wsframe.WS_PROTOCOL_ERROR)
+
+        try:
+            reason = data[2:].decode('utf-8')
+        except UnicodeDecodeError:
+            raise InvalidFrameError(_NON_UTF_8_MSG, wsframe.WS_INVALID_PAYLOAD_DATA) from None
+
+        return CloseEvent(code, reason)
+
+    def _decode_text(self, data):
+        if not self.decode_text:
+            return data
+
+        if self.text_mode == 'str':
+            return data.decode('utf-8')
+
+        if self.validate_utf8:
+            validate_utf8(data)
+
+        return data
+
+    def _handle_data_frame(self, op, fin, data):
+        if op == wsframe.OP_CONTINUATION:
+            if self._fragmented_op is None:
+                raise InvalidFrameError(_UNEXPECTED_CONT_MSG, wsframe.WS_PROTOCOL_ERROR)
+
+            self._write_fragment(data)
+
+            if not fin:
+                return None
+
+            op = self._fragmented_op
+            data = self._finish_fragments()
+        elif self._fragmented_op is not None:
+            raise InvalidFrameError(_EXPECTED_CONT_MSG, wsframe.WS_PROTOCOL_ERROR)
+        elif not fin:
+            self._setup_fragmenter(op, data)
+            return None
+        elif op == wsframe.OP_TEXT:
+            data = self._decode_text(data)
+
+        if op == wsframe.OP_TEXT:
+            return TextEvent(data)
+        else:
+            return BinaryEvent(data)
+
+    def _setup_fragmenter(self, op, data):
+        self._fragmented_op = op
+        if op == wsframe.OP_TEXT and self.decode_text:
+            if self.text_mode == 'str':
+                self._fragment_decoder = _IncrementalDecoder()
+                self._fragment_buffer = StringIO()
+            else:
+                if self.validate_utf8:
+                    self._fragment_decoder = _IncrementalDecoder()
+                self._fragment_buffer = BytesIO()
+        else:
+            self._fragment_buffer = BytesIO()
+
+        self._write_fragment(data)
+
+    def _write_fragment(self, data):
+        if self._fragment_decoder is not None:
+            if self.text_mode == 'str':
+                data = self._fragment_decoder.decode(data)
+            else:
+                _feed_validator(self._fragment_decoder, data)
+        self._fragment_buffer.write(data)
+
+    def _finish_fragments(self):
+        try:
+            if self._fragment_decoder is not None:
+                self._fragment_decoder.decode(b'', final=True)
+            return self._fragment_buffer.getvalue()
+        finally:
+            self._fragmented_op = None
+            self._fragment_buffer = None
+            self._fragment_decoder = None
+
+    def prepare(self, head, data=None, *, code=None, mask=None):
+        """Encodes the header and unmasked payload of a frame.
+
+        This avoids creating a `WebSocketFrame`, control frames are checked
+        against the 125 byte limit and close codes are validated.
+
+        Arguments:
+            head (int): The first byte of the frame.
+
+            data (Optional[str | int | BytesLike]): The data to send in the frame.
+
+            code (Optional[int]): The close code of a close frame.
+
+            mask (Optional[bool]): Whether to mask the frame, defaults to `self.mask`.
+
+        Returns:
+            tuple[bytearray, bytes, Optional[bytes]]: The header, the payload
+                and the masking key the payload should be masked with.
+        """
+        data = encode_payload(data, code)
+
+        if head & 0x8 and len(data) > 125:
+            raise ValueError('Control frame data length shouldn\'t exceed 125')
+
+        if code is not None and not wsframe.is_close_code(code):
+            raise ValueError('Invalid close code')
+
+        if mask is None:
+            mask = self.mask
+
+        key = self.genmask() if mask else None
+
+        return encode_header(head, len(data), key), data, key
+
+    def prepare_frame(self, frame, *, mask=None):
+        """Validates a frame and encodes its header and unmasked payload.
+
+        Arguments:
+            frame (WebSocketFrame): The frame to prepare.
+
+            mask (Optional[bool]): Whether to mask the frame, defaults to `self.mask`.
+
+        Returns:
+            tuple[bytearray, bytes, Optional[bytes]]: The header, the payload
+                and the masking key the payload should be masked with.
+        """
+        if not isinstance(frame, wsframe.WebSocketFrame):
+            raise TypeError(f'frame should be a WebSocketFrame, got {type(frame).__name__!r}')
+
+        frame.validate()
+
+        return self.prepare(frame.head, frame.data, code=frame.code, mask=mask)
+
+    def prepare_message(self, head, data=None, *, mask=None):
+        """Encodes the headers and unmasked payloads of a data message.
+
+        The message is split into continuation frames if its payload is
+        larger than `max_frame_size`, each with its own masking key.
+
+        Arguments:
+            head (int): The first byte of the message's first frame.
+
+            data (Optional[str | int | BytesLike]): The data to send in the message.
+
+            mask (Optional[bool]): Whether to mask the frames, defaults to `self.mask`.
+
+        Returns:
+            list[tuple[bytearray, BytesLike, Optional[bytes]]]: The header,
+                the payload and the masking key of each frame, payloads of
+                fragments are views of the message's payload.
+        """
+        data = encode_payload(data)
+
+        max_size = self.max_frame_size
+        length = len(data)
+
+        if max_size is None or length <= max_size:
+            return [self.prepare(head, data, mask=mask)]
+
+        if mask is None:
+            mask = self.mask
+
+        frames = []
+        view = memoryview(data)
+
+        head &= ~FIN
+        for start in range(0, length, max_size):
+            if start + max_size >= length:
+                head |= FIN
+
+            key = self.genmask() if mask else None
+            payload = view[start:start + max_size]
+
+            frames.append((encode_header(head, len(payload), key), payload, key))
+            head = wsframe.OP_CONTINUATION
+
+        return frames
+
+    def _append(self, buffer, data, key):
+        if key is not None:
+            data = util.mask(data, key)
+
+        buffer.extend(data)
+        self._outgoing.append(buffer)
+
+    def send(self, head, data=None, *, code=None, mask=None):
+        """Encodes a frame into the outgoing buffer, see `prepare`."""
+        self._append(*self.prepare(head, data, code=code, mask=mask))
+
+    def send_frame(self, frame, *, mask=None):
+        """Encodes a frame into the outgoing buffer.
+
+        Arguments:
+            frame (WebSocketFrame): The frame to send.
+
+            mask (Optional[bool]): Whether to mask the frame, defaults to `self.mask`.
+        """
+        self._append(*self.prepare_frame(frame, mask=mask))
+
+    def ping(self, data=None, *, mask=None):
+        self.send(FIN | wsframe.OP_PING, data, mask=mask)
+
+    def pong(self, data=None, *, mask=None):
+        self.send(FIN | wsframe.OP_PONG, data, mask=mask)
+
+    def close(self, data=None, *, code=wsframe.WS_NORMAL_CLOSURE, mask=None):
+        self.send(FIN | wsframe.OP_CLOSE, data, code=code, mask=mask)
+
+    def write(self, data, *, binary=False, mask=None):
+        head = FIN | (wsframe.OP_BINARY if binary else wsframe.OP_TEXT)
+        for frame in self.prepare_message(head, data, mask=mask):
+            self._append(*frame)
+
+    def data_to_send(self):
+        """Returns and clears the encoded frames sent since the last call.
+
+        Returns:
+            BytesLike: The data to send.
+        """
+        if not self._outgoing:
+            return b''
+        elif len(self._outgoing) == 1:
+            return self._outgoing.pop()
+
+        data = b''.join(self._outgoing)
+        self._outgoing.clear()
+
+        return data
@@ -45,7 +45,13 @@ WS_CLOSE_CODES = {
 }
 
 
+# These codes report why a connection closed, they are never sent in a close frame
+WS_RESERVED_CLOSE_CODES = frozenset((WS_NO_STATUS_RECEIVED, WS_ABNORMAL_CLOSURE, WS_TLS_HANDSHAKE))
+
+
 def is_close_code(code):
+    if code in WS_RESERVED_CLOSE_CODES:
+        return False
     return code in WS_CLOSE_CODES or 3000 <= code <= 4999
 
 
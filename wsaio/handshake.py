@@ -1,18 +1,156 @@
-import asyncio
+import functools
 from http import HTTPStatus
 from urllib.parse import urlparse
 
 from .import headers as httphdrs
 from .exceptions import HandshakeFailureError
 from .stream import Stream
+from .timer import get_timer_wheel
 from .util import genacckey, genseckey
 
 SWITCHING_PROTOCOLS = HTTPStatus.SWITCHING_PROTOCOLS
 
+MAX_HEADER_SIZE = 1 << 16
+
+_LARGE_RESPONSE_MSG = 'The handshake response headers exceeded {} bytes'
+_CLOSED_MSG = 'The connection was closed during the handshake'
+
+
+@functools.lru_cache(maxsize=256)
+def build_request_template(host, port, path, query):
+    """Builds the handshake request for a URL, split around the secret key.
+
+    The result is cached so that repeated handshakes to the same URL only
+    need to join the two halves with a fresh key.
+
+    Arguments:
+        host (str): The host of the URL.
+
+        port (int): The port of the URL.
+
+        path (str): The path of the URL.
+
+        query (str): The query string of the URL, including the leading '?'.
+    """
+    lines = (
+        f'GET {path}{query} HTTP/1.1',
+        f'{httphdrs.HOST}: {host}:{port}',
+        f'{httphdrs.CONNECTION}: Upgrade',
+        f'{httphdrs.UPGRADE}: websocket',
+        f'{httphdrs.SEC_WEBSOCKET_VERSION}: 13',
+        f'{httphdrs.SEC_WEBSOCKET_KEY}: ',
+    )
+
+    return '\r\n'.join(lines).encode('utf-8'), b'\r\n\r\n'
+
+
+def parse_url(url):
+    """Parses a WebSocket URL.
+
+    Arguments:
+        url (str): The URL, its scheme should be ws or wss.
+
+    Returns:
+        tuple[tuple[str, int, str, str], bool]: The host, port, path and
+            query of the URL, and whether it uses TLS.
+    """
+    result = urlparse(url)
+
+    if result.scheme not in ('ws', 'wss'):
+        raise ValueError(f'Invalid url scheme for WebSocket {result.scheme}')
+
+    secure = result.scheme == 'wss'
+
+    host = result.hostname
+
+    if not result.port:
+        port = 443 if secure else 80
+    else:
+        port = result.port
+
+    if not result.path:
+        path = '/'
+    else:
+        path = result.path
+
+    if not result.query:
+        query = ''
+    else:
+        query = f'?{result.query}'
+
+    return (host, port, path, query), secure
+
+
+def parse_response_head(data):
+    """Parses the status line and headers of a handshake response.
+
+    Arguments:
+        data (BytesLike): The response up to, but excluding, the blank line.
+
+    Returns:
+        tuple[HTTPHeaders, str, str]: The headers, HTTP version and status code.
+
+    Raises:
+        HandshakeFailureError: The response is malformed.
+    """
+    status, *lines = data.decode('latin-1').split('\r\n')
+
+    try:
+        version, code, *_ = status.split(' ', 2)
+    except ValueError:
+        raise HandshakeFailureError(
+            f'The handshake response has a malformed status line: {status!r}'
+        ) from None
+
+    headers = httphdrs.HTTPHeaders()
+
+    for line in lines:
+        key, sep, value = line.partition(':')
+        if not sep:
+            raise HandshakeFailureError(f'The handshake response has a malformed header: {line!r}')
+
+        headers[key.strip()] = value.strip()
+
+    return headers, version, code
+
+
+def check_response(headers, version, code, acckey):
+    """Checks that a handshake response accepts the WebSocket upgrade.
+
+    Arguments:
+        headers (HTTPHeaders): The response headers.
+
+        version (str): The HTTP version of the response.
+
+        code (str): The status code of the response.
+
+        acckey (str): The expected accept key, see `genacckey`.
+
+    Raises:
+        HandshakeFailureError: The response does not accept the upgrade.
+    """
+    if version != 'HTTP/1.1':
+        raise HandshakeFailureError(f'Expected HTTP/1.1, got {version}')
+
+    if code != str(SWITCHING_PROTOCOLS.value):
+        raise HandshakeFailureError(f'Expected status code 101, got {code}')
+
+    if headers.getone(httphdrs.CONNECTION).lower() != 'upgrade':
+        raise HandshakeFailureError(f'The {httphdrs.CONNECTION!r} header is not \'upgrade\'')
+
+    if headers.getone(httphdrs.UPGRADE).lower() != 'websocket':
+        raise HandshakeFailureError(f'The {httphdrs.UPGRADE!r} header is not \'websocket\'')
+
+    if headers.getone(httphdrs.SEC_WEBSOCKET_ACCEPT) != acckey:
+        raise HandshakeFailureError(
+            f'The {httphdrs.SEC_WEBSOCKET_ACCEPT!r} header does not match the secret key'
+        )
+
 
 class WebSocketHandshake:
-    def __init__(self, urlinfo, *,  stream):
+    def __init__(self, urlinfo, *, stream, max_header_size=MAX_HEADER_SIZE):
         self.host, self.port, self.path, self.query = urlinfo
+        self.max_header_size = max_header_size
 
         self.stream = stream
         self.stream.set_parser(self.parse_response)
@@ -20,115 +158,80 @@ class WebSocketHandshake:
         self._future = self.stream.loop.create_future()
 
     @classmethod
-    async def from_url(cls, url, *, loop, **kwargs):
-        result = urlparse(url)
-
-        if result.scheme not in ('ws', 'wss'):
-            raise ValueError(f'Invalid url scheme for WebSocket {url.scheme}')
-
-        host = result.hostname
+    async def from_url(cls, url, *, loop, max_header_size=MAX_HEADER_SIZE, **kwargs):
+        urlinfo, secure = parse_url(url)
+        if secure:
+            kwargs.setdefault('ssl', True)
 
-        if not result.port:
-            if result.scheme == 'wss':
-                port = 443
-                kwargs.setdefault('ssl', True)
-            else:
-                port = 80
-        else:
-            port = result.port
-
-        if not result.path:
-            path = '/'
-        else:
-            path = result.path
-
-        if not result.query:
-            query = ''
-        else:
-            query = f'?{result.query}'
+        host, port, _, _ = urlinfo
 
         stream = Stream(loop=loop)
         await stream.create_protocol(host, port, **kwargs)
 
-        return cls((host, port, path, query), stream=stream)
+        return cls(urlinfo, stream=stream, max_header_size=max_header_size)
 
     def parse_response(self, ctx):
-        status = None
-        headers = httphdrs.HTTPHeaders()
-
         buffer = ctx.get_buffer()
         start = 0
 
         while True:
+            index = buffer.find(b'\r\n\r\n', start)
+            if index != -1 or len(buffer) > self.max_header_size:
+                break
+
+            # The terminator may straddle the segment boundary
+            start = max(len(buffer) - 3, 0)
+
             try:
-                index = buffer.index(b'\r\n', start)
-            except ValueError:
                 yield from ctx.fill()
-            else:
-                if status is None:
-                    status = buffer[start:index].decode('utf-8')
-                else:
-                    key, value = buffer[start:index].split(b':', 1)
-                    key = key.strip().decode('utf-8')
-                    value = value.strip().decode('utf-8')
+            except (EOFError, ConnectionError):
+                if not self._future.done():
+                    self._future.set_exception(HandshakeFailureError(_CLOSED_MSG))
+                return
 
-                    headers[key] = value
+        if index == -1 or index > self.max_header_size:
+            exc = HandshakeFailureError(_LARGE_RESPONSE_MSG.format(self.max_header_size))
+            self._future.set_exception(exc)
+            ctx.reset_parser()
+            return
 
-                start = index + 2
+        head = buffer[:index]
+        del buffer[:index + 4]
 
-                if buffer[index + 2:index + 4] == b'\r\n':
-                    del buffer[:index + 4]
-                    break
-
-        self._future.set_result((headers, status.split(' ', 2)))
+        try:
+            self._future.set_result(parse_response_head(head))
+        except HandshakeFailureError as exc:
+            self._future.set_exception(exc)
 
         ctx.reset_parser()
 
     async def negotiate(self, *, timeout):
-        seckey = genseckey()
-        acckey = genacckey(seckey.encode('utf-8'))
-
-        headers = httphdrs.HTTPHeaders()
-
-        headers[httphdrs.HOST] = f'{self.host}:{self.port}'
-        headers[httphdrs.CONNECTION] = 'Upgrade'
-        headers[httphdrs.UPGRADE] = 'websocket'
-        headers[httphdrs.SEC_WEBSOCKET_KEY] = seckey
-        headers[httphdrs.SEC_WEBSOCKET_VERSION] = '13'
+        seckey = genseckey().encode('utf-8')
+        acckey = genacckey(seckey)
 
-        self.stream.write(f'GET {self.path}{self.query} HTTP/1.1\r\n')
+        head, tail = build_request_template(self.host, self.port, self.path, self.query)
+        self.stream.write(b''.join((head, seckey, tail)))
 
-        for key, values in headers.items():
-            for value in values:
-                self.stream.write(f'{key}: {value}\r\n')
-
-        self.stream.write('\r\n')
+        if timeout is not None:
+            timer = get_timer_wheel(self.stream.loop).call_later(timeout, self._timeout)
+        else:
+            timer = None
 
         try:
-            headers, (version, code, _) = await asyncio.wait_for(self._future, timeout=timeout)
-        except asyncio.TimeoutError:
-            raise HandshakeFailureError(
-                'The handshake timed out while waiting for response'
-            ) from None
-
-        if version != 'HTTP/1.1':
-            raise HandshakeFailureError(f'Expected HTTP/1.1, got {version}')
-
-        if code != str(SWITCHING_PROTOCOLS.value):
-            raise HandshakeFailureError(f'Expected status code 101, got {code}')
+            headers, version, code = await self._future
+        finally:
+            if timer is not None:
+                timer.cancel()
 
-        if headers.getone(httphdrs.CONNECTION).lower() != 'upgrade':
-            raise HandshakeFailureError(f'The {httphdrs.CONNECTION!r} header is not \'upgrade\'')
+        check_response(headers, version, code, acckey)
 
-        if headers.getone(httphdrs.UPGRADE).lower() != 'websocket':
-            raise HandshakeFailureError(f'The {httphdrs.UPGRADE!r} header is not \'websocket\'')
+        return self.stream
 
-        if headers.getone(httphdrs.SEC_WEBSOCKET_ACCEPT) != acckey:
-            raise HandshakeFailureError(
-                f'The {httphdrs.SEC_WEBSOCKET_ACCEPT!r} header does not match the secret key'
+    def _timeout(self):
+        if not self._future.done():
+            self._future.set_exception(
+                HandshakeFailureError('The handshake timed out while waiting for response')
             )
 
-        return self.stream
-
     def shutdown(self):
         self.stream.close()
@@ -0,0 +1,45 @@
+import asyncio
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+_UNKNOWN_LOOP_MSG = 'The event loop implementation should be \'auto\', \'asyncio\' or \'uvloop\''
+
+
+def get_loop_implementations():
+    """Returns the names of the event loop implementations that are installed."""
+    if uvloop is None:
+        return ['asyncio']
+    return ['asyncio', 'uvloop']
+
+
+def is_uvloop(loop):
+    return uvloop is not None and isinstance(loop, uvloop.Loop)
+
+
+def new_event_loop(implementation='auto'):
+    """Creates an event loop.
+
+    Arguments:
+        implementation (str): 'uvloop', 'asyncio' for the standard library's
+            loop, or 'auto' for uvloop if it is installed and asyncio otherwise.
+
+    Returns:
+        asyncio.AbstractEventLoop: The event loop.
+
+    Raises:
+        RuntimeError: uvloop was requested but it is not installed.
+    """
+    if implementation == 'auto':
+        implementation = 'asyncio' if uvloop is None else 'uvloop'
+
+    if implementation == 'uvloop':
+        if uvloop is None:
+            raise RuntimeError('uvloop is not installed')
+        return uvloop.new_event_loop()
+    elif implementation == 'asyncio':
+        return asyncio.new_event_loop()
+
+    raise ValueError(_UNKNOWN_LOOP_MSG)
@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from . import frame as wsframe
+
+logger = logging.getLogger(__name__)
+
+_SLOW_HANDLER_MSG = 'A {} handler held the event loop for {:.3f}s on connection {}'
+_LOOP_LAG_MSG = 'The event loop lagged by {:.3f}s'
+
+_MESSAGE_TYPES = {
+    wsframe.OP_TEXT: 'text',
+    wsframe.OP_BINARY: 'binary',
+    wsframe.OP_PING: 'ping',
+    wsframe.OP_PONG: 'pong',
+    wsframe.OP_CLOSE: 'close',
+}
+
+
+def _describe(stream):
+    transport = stream.transport
+    if transport is not None:
+        peername = transport.get_extra_info('peername')
+        if peername is not None:
+            return peername
+    return repr(stream)
+
+
+class _MonitoredCallback:
+    __slots__ = ('monitor', 'coro', 'stream', 'op')
+
+    def __init__(self, monitor, coro, stream, op):
+        self.monitor = monitor
+        self.coro = coro
+        self.stream = stream
+        self.op = op
+
+    def __await__(self):
+        return self.monitor._drive(self.coro, self.stream, self.op)
+
+
+class LoopMonitor:
+    """A monitor for handlers that block the event loop.
+
+    Every step of a handler, i.e. the time between two awaits, holds the
+    event loop. Steps that take longer than the threshold produce a warning
+    naming the connection and message type, and a periodic probe measures
+    how late the event loop wakes up.
+
+    Arguments:
+        slow_threshold (float): The number of seconds a handler step may
+            hold the event loop before it is reported.
+
+        lag_threshold (float): The number of seconds the probe may be late
+            before the lag is reported.
+
+        lag_interval (float): The number of seconds between probes.
+
+        on_warning (Optional[Callable[[dict], Any]]): Called with each
+            warning, the default logs it to the 'wsaio.monitor' logger with
+            the warning in the record's `monitor` attribute.
+
+        on_stack (Optional[Callable[[dict, traceback.StackSummary], Any]]):
+            Called from a watchdog thread with the stack of a handler that
+            is still holding the event loop past the threshold.
+
+    Attributes:
+        handler_calls (int): The number of handlers that were run.
+
+        slow_calls (int): The number of handler steps that crossed the threshold.
+
+        max_hold (float): The longest time a handler step held the event loop.
+
+        max_lag (float): The largest lag measured by the probe.
+    """
+
+    def __init__(
+        self, *, slow_threshold=0.1, lag_threshold=0.1, lag_interval=0.5, on_warning=None,
+        on_stack=None
+    ):
+        self.slow_threshold = slow_threshold
+        self.lag_threshold = lag_threshold
+        self.lag_interval = lag_interval
+
+        self.on_warning = on_warning
+        self.on_stack = on_stack
+
+        self.handler_calls = 0
+        self.slow_calls = 0
+        self.max_hold = 0.0
+        self.max_lag = 0.0
+
+        self._probe_task = None
+        self._watchdog = None
+        self._thread_id = None
+
+        # The number of clients using the monitor, None if it was started explicitly
+        self._users = None
+
+        # The handler step that is running and the slowest step since the last probe
+        self._current = None
+        self._worst = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} slow_threshold={self.slow_threshold}>'
+
+    def is_running(self):
+        return self._probe_task is not None
+
+    def start(self, loop):
+        """Starts the lag probe and the watchdog thread, this must be called
+        from the thread running the loop and does nothing if already started.
+        """
+        if self._probe_task is not None:
+            return
+
+        self._thread_id = threading.get_ident()
+        self._probe_task = loop.create_task(self._probe(loop))
+
+        if self.on_stack is not None:
+            self._watchdog = threading.Thread(
+                target=self._watch, args=(self._probe_task,), daemon=True
+            )
+            self._watchdog.start()
+
+    def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+        self._watchdog = None
+        self._users = None
+
+    def acquire(self, loop):
+        """Starts the monitor for a client if it isn't running already."""
+        if self._probe_task is None:
+            self.start(loop)
+            self._users = 1
+        elif self._users is not None:
+            self._users += 1
+
+    def release(self):
+        """Stops the monitor once every client that acquired it has released it."""
+        if self._users is None:
+            return
+
+        self._users -= 1
+        if self._users == 0:
+            self.stop()
+
+    def wrap(self, coro, stream, op):
+        """Wraps a handler's coroutine so that the time it holds the event
+        loop is measured.
+
+        Arguments:
+            coro (Coroutine): The handler's coroutine.
+
+            stream (Stream): The stream of the connection the message arrived on.
+
+            op (int): The opcode of the message.
+
+        Returns:
+            Coroutine: A coroutine that runs the handler.
+        """
+        return self._run(_MonitoredCallback(self, coro, stream, op))
+
+    async def _run(self, callback):
+        return await callback
+
+    def _drive(self, coro, stream, op):
+        self.handler_calls += 1
+
+        value = None
+        error = None
+
+        while True:
+            start = time.perf_counter()
+            self._current = (start, stream, op)
+
+            try:
+                if error is None:
+                    future = coro.send(value)
+                else:
+                    future = coro.throw(error)
+            except StopIteration as exc:
+                return exc.value
+            finally:
+                self._current = None
+                self._record(time.perf_counter() - start, stream, op)
+
+            try:
+                value = yield future
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as exc:
+                value = None
+                error = exc
+            else:
+                error = None
+
+    def _record(self, held, stream, op):
+        if held > self.max_hold:
+            self.max_hold = held
+
+        if self._worst is None or held > self._worst[0]:
+            self._worst = (held, stream, op)
+
+        if held >= self.slow_threshold:
+            self.slow_calls += 1
+
+            connection = _describe(stream)
+            message_type = _MESSAGE_TYPES.get(op, op)
+
+            self._warn(
+                {
+                    'type': 'slow_handler',
+                    'connection': connection,
+                    'message_type': message_type,
+                    'duration': held,
+                },
+                _SLOW_HANDLER_MSG.format(message_type, held, connection),
+            )
+
+    async def _probe(self, loop):
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+
+            lag = loop.time() - start - self.lag_interval
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+            worst = self._worst
+            self._worst = None
+
+            if lag >= self.lag_threshold:
+                warning = {'type': 'loop_lag', 'lag': lag}
+
+                # The slowest handler since the last probe is the likely culprit
+                if worst is not None:
+                    held, stream, op = worst
+                    warning['connection'] = _describe(stream)
+                    warning['message_type'] = _MESSAGE_TYPES.get(op, op)
+                    warning['duration'] = held
+
+                self._warn(warning, _LOOP_LAG_MSG.format(lag))
+
+    def _warn(self, warning, message):
+        if self.on_warning is not None:
+            self.on_warning(warning)
+        else:
+            logger.warning(message, extra={'monitor': warning})
+
+    def _watch(self, task):
+        sampled = None
+
+        while self._probe_task is task:
+            time.sleep(self.slow_threshold / 2)
+
+            current = self._current
+            if current is None or current is sampled:
+                continue
+
+            start, stream, op = current
+            held = time.perf_counter() - start
+            if held < self.slow_threshold:
+                continue
+
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            sampled = current
+            self.on_stack(
+                {
+                    'type': 'slow_handler',
+                    'connection': _describe(stream),
+                    'message_type': _MESSAGE_TYPES.get(op, op),
+                    'duration': held,
+                },
+                traceback.extract_stack(frame),
+            )
+
+    def get_stats(self):
+        return {
+            'handler_calls': self.handler_calls,
+            'slow_calls': self.slow_calls,
+            'max_hold': self.max_hold,
+            'max_lag': self.max_lag,
+        }
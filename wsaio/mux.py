@@ -0,0 +1,339 @@
+import struct
+from collections import deque
+
+from .exceptions import InvalidFrameError
+from .frame import WS_PROTOCOL_ERROR
+from .util import getbytes
+
+MUX_DATA = 0x0
+MUX_TEXT = 0x1
+MUX_WINDOW = 0x2
+MUX_CLOSE = 0x3
+
+_HEADER = struct.Struct('!BH')
+_CREDIT = struct.Struct('!I')
+
+MAX_CHANNEL_ID = 0xFFFF
+
+_CHANNEL_CLOSED_MSG = 'The channel was closed'
+_SHORT_MESSAGE_MSG = 'The multiplexed message is shorter than its header'
+_INVALID_TYPE_MSG = 'The multiplexed message has an unknown type: {}'
+_INVALID_WINDOW_MSG = 'The window update should carry a {} byte credit'
+_WINDOW_EXCEEDED_MSG = 'The peer sent on channel {} after its send window was used up'
+_INVALID_TEXT_MSG = 'The channel was closed after receiving text that is not valid UTF-8'
+
+
+class Channel:
+    """A logical channel carried by a `Multiplexer`.
+
+    Attributes:
+        id (int): The channel's ID.
+
+        send_window (int): The number of bytes that may be sent before the
+            peer grants more, a message is sent while it is positive.
+
+        receive_window (int): The number of bytes the peer may still send
+            before this side grants more, the peer follows the same rule.
+    """
+
+    def __init__(self, multiplexer, channel_id, window):
+        self.multiplexer = multiplexer
+        self.id = channel_id
+        self.send_window = window
+        self.receive_window = window
+
+        self._closed = False
+        self._close_exc = None
+
+        self._outgoing = deque()
+        self._deficit = 0
+
+        self._received = deque()
+        self._receive_waiter = None
+        self._consumed = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} id={self.id} send_window={self.send_window}>'
+
+    def is_closed(self):
+        return self._closed
+
+    async def send(self, data):
+        """Sends a message on the channel.
+
+        The message waits for its turn among the channels with pending
+        messages and for the channel's send window to be positive.
+
+        Arguments:
+            data (str | int | BytesLike): The data to send, str is sent as text.
+
+        Raises:
+            ConnectionResetError: The channel or the connection was closed.
+        """
+        if self._closed:
+            raise ConnectionResetError(_CHANNEL_CLOSED_MSG)
+
+        mtype = MUX_TEXT if isinstance(data, str) else MUX_DATA
+        future = self.multiplexer.loop.create_future()
+
+        self._outgoing.append((mtype, getbytes(data), future))
+        self.multiplexer._schedule(self)
+
+        await future
+
+    async def recv(self):
+        """Receives the next message on the channel.
+
+        Receiving a message gives the peer more credit to send with.
+
+        Returns:
+            str | bytes: The message, str if it was sent as text.
+
+        Raises:
+            ConnectionResetError: The channel was closed and all of its
+                messages have been received.
+        """
+        while not self._received:
+            if self._closed:
+                raise self._close_exc
+
+            self._receive_waiter = self.multiplexer.loop.create_future()
+            try:
+                await self._receive_waiter
+            finally:
+                self._receive_waiter = None
+
+        data, size = self._received.popleft()
+
+        self._consumed += size
+        if self._consumed >= self.multiplexer.window // 2:
+            self.multiplexer._send_control(MUX_WINDOW, self.id, _CREDIT.pack(self._consumed))
+            self.receive_window += self._consumed
+            self._consumed = 0
+
+        return data
+
+    async def close(self):
+        """Closes the channel, messages that are still queued are discarded."""
+        if self._closed:
+            return
+
+        self.multiplexer._send_control(MUX_CLOSE, self.id, b'')
+        self._close(ConnectionResetError(_CHANNEL_CLOSED_MSG))
+
+    def _deliver(self, data, size):
+        self._received.append((data, size))
+        self._wake()
+
+    def _wake(self):
+        if self._receive_waiter is not None and not self._receive_waiter.done():
+            self._receive_waiter.set_result(None)
+
+    def _close(self, exc):
+        self._closed = True
+        self._close_exc = exc
+        self.multiplexer._channels.pop(self.id, None)
+
+        while self._outgoing:
+            _, _, future = self._outgoing.popleft()
+            if not future.done():
+                future.set_exception(exc)
+
+        self._wake()
+
+
+class Multiplexer:
+    """Carries many logical channels over one WebSocket connection.
+
+    Each channel message is sent as a binary message that starts with a
+    3 byte header, the message type and the channel ID, so the peer must
+    use a `Multiplexer` too. Channels have a send window that the peer
+    replenishes as it receives messages, a slow receiver only stalls its
+    own channel. Channels with pending messages take turns with deficit
+    round-robin, so a bulk channel sends at most about a quantum of bytes
+    before each other channel gets a turn.
+
+    Arguments:
+        window (int): The initial send window of a channel in bytes.
+
+        quantum (int): The number of bytes a channel may send per turn.
+
+        initiator (bool): Whether this side uses odd channel IDs, the peer
+            must use the opposite.
+
+        on_channel (Optional[Callable[[Channel], Awaitable]]): Called with
+            the channels the peer opens, channels are opened implicitly by
+            their first message.
+    """
+
+    def __init__(self, *, window=1 << 16, quantum=1 << 14, initiator=True, on_channel=None):
+        self.window = window
+        self.quantum = quantum
+        self.initiator = initiator
+        self.on_channel = on_channel
+
+        self.writer = None
+        self.loop = None
+
+        self._channels = {}
+        self._next_id = 1 if initiator else 2
+
+        self._active = deque()
+        self._sender = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} channels={len(self._channels)}>'
+
+    def attach(self, writer):
+        """Sets the writer that channel messages are written to."""
+        self.writer = writer
+        self.loop = writer.stream.loop
+
+    def get_channels(self):
+        return list(self._channels.values())
+
+    def open_channel(self, channel_id=None):
+        """Opens a channel.
+
+        Arguments:
+            channel_id (Optional[int]): The channel's ID, the next unused ID of
+                this side's parity is used if omitted.
+
+        Returns:
+            Channel: The channel.
+        """
+        if channel_id is None:
+            while self._next_id in self._channels:
+                self._next_id += 2
+
+            channel_id = self._next_id
+            self._next_id += 2
+
+        if not 0 < channel_id <= MAX_CHANNEL_ID:
+            raise ValueError(f'The channel ID should be between 1 and {MAX_CHANNEL_ID}')
+
+        if channel_id in self._channels:
+            raise ValueError(f'The channel {channel_id} is already open')
+
+        channel = self._channels[channel_id] = Channel(self, channel_id, self.window)
+        return channel
+
+    def _is_peer_id(self, channel_id):
+        return (channel_id % 2 == 1) != self.initiator
+
+    def feed(self, data):
+        """Handles a binary message received from the peer.
+
+        Raises:
+            InvalidFrameError: The message is not a valid multiplexed message.
+        """
+        if len(data) < _HEADER.size:
+            raise InvalidFrameError(_SHORT_MESSAGE_MSG, WS_PROTOCOL_ERROR)
+
+        mtype, channel_id = _HEADER.unpack_from(data)
+        payload = data[_HEADER.size:]
+
+        channel = self._channels.get(channel_id)
+
+        if mtype == MUX_DATA or mtype == MUX_TEXT:
+            if channel is None:
+                # Messages for channels that were closed on this side are dropped
+                if not self._is_peer_id(channel_id):
+                    return
+
+                channel = self.open_channel(channel_id)
+                if self.on_channel is not None:
+                    self.loop.create_task(self.on_channel(channel))
+
+            # The peer may overshoot with the message it sent while its window was positive
+            if channel.receive_window <= 0:
+                raise InvalidFrameError(_WINDOW_EXCEEDED_MSG.format(channel_id), WS_PROTOCOL_ERROR)
+
+            size = len(payload)
+            channel.receive_window -= size
+
+            if mtype == MUX_TEXT:
+                try:
+                    payload = payload.decode('utf-8')
+                except UnicodeDecodeError:
+                    self._send_control(MUX_CLOSE, channel_id, b'')
+                    channel._close(ConnectionResetError(_INVALID_TEXT_MSG))
+                    return
+
+            channel._deliver(payload, size)
+        elif mtype == MUX_WINDOW:
+            if len(payload) != _CREDIT.size:
+                raise InvalidFrameError(_INVALID_WINDOW_MSG.format(_CREDIT.size), WS_PROTOCOL_ERROR)
+
+            if channel is not None:
+                channel.send_window += _CREDIT.unpack(payload)[0]
+                if channel._outgoing:
+                    self._schedule(channel)
+        elif mtype == MUX_CLOSE:
+            if channel is not None:
+                channel._close(ConnectionResetError(_CHANNEL_CLOSED_MSG))
+        else:
+            raise InvalidFrameError(_INVALID_TYPE_MSG.format(mtype), WS_PROTOCOL_ERROR)
+
+    def fail_all(self, exc):
+        """Closes every channel, e.g. when the connection was closed."""
+        for channel in list(self._channels.values()):
+            channel._close(exc)
+
+        self._active.clear()
+
+    def _schedule(self, channel):
+        if channel not in self._active:
+            self._active.append(channel)
+
+        if self._sender is None:
+            self._sender = self.loop.create_task(self._send_loop())
+
+    def _send_control(self, mtype, channel_id, payload):
+        # Control messages skip the scheduler, they are small and unblock the peer
+        self.loop.create_task(self._write_control(mtype, channel_id, payload))
+
+    async def _write_control(self, mtype, channel_id, payload):
+        try:
+            await self._write(mtype, channel_id, payload)
+        except ConnectionError:
+            # The connection is closing, the peer has no use for the message
+            pass
+
+    async def _write(self, mtype, channel_id, payload):
+        await self.writer.write(
+            _HEADER.pack(mtype, channel_id) + payload,
+            binary=True,
+            mask=self.writer.connection.mask,
+        )
+
+    async def _send_loop(self):
+        try:
+            while self._active:
+                channel = self._active.popleft()
+                channel._deficit += self.quantum
+
+                while channel._outgoing and channel._deficit > 0 and channel.send_window > 0:
+                    mtype, data, future = channel._outgoing.popleft()
+
+                    try:
+                        await self._write(mtype, channel.id, data)
+                    except Exception as exc:
+                        if not future.done():
+                            future.set_exception(exc)
+                        continue
+
+                    channel._deficit -= len(data)
+                    channel.send_window -= len(data)
+
+                    if not future.done():
+                        future.set_result(None)
+
+                if channel._outgoing and channel.send_window > 0:
+                    self._active.append(channel)
+                else:
+                    # Idle or blocked channels don't save up turns, a window
+                    # update schedules a blocked channel again
+                    channel._deficit = 0
+        finally:
+            self._sender = None
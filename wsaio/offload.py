@@ -0,0 +1,126 @@
+import time
+
+
+def _timed(func, args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class OffloadPolicy:
+    """A policy for running CPU-bound payload work in an executor.
+
+    Payloads smaller than the threshold are processed inline on the event
+    loop, larger payloads are sent to the executor.
+
+    A thread only frees the event loop while the work releases the GIL.
+    Masking and UTF-8 decoding release it between 64 KiB chunks, only the
+    final join of a decoded text holds it for long. A codec's decoder (e.g.
+    json.loads) is a single call that holds the GIL throughout, so it blocks
+    the loop about as long as running it inline would. A process pool
+    doesn't help either, pickling the payload and result holds the GIL for
+    about as long as decoding does. `blocked_time` shows what is left.
+
+    Arguments:
+        executor (Optional[concurrent.futures.Executor]): The executor to use,
+            None uses the event loop's default executor.
+
+        threshold (int): The payload size in bytes at which work is offloaded.
+
+        probe_interval (float): The interval of the timer that measures how
+            long the event loop is blocked while offloaded calls run.
+
+    Attributes:
+        offloaded_calls (int): The number of calls run in the executor.
+
+        offloaded_bytes (int): The number of payload bytes processed in the executor.
+
+        inline_calls (int): The number of calls run on the event loop.
+
+        executor_time (float): The number of seconds the offloaded calls took
+            in the executor.
+
+        blocked_time (float): The number of seconds the event loop was
+            blocked while offloaded calls were running, measured by how late
+            a timer fires, so it is accurate to about the probe interval.
+    """
+
+    def __init__(self, *, executor=None, threshold=1 << 20, probe_interval=0.002):
+        self.executor = executor
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+
+        self.offloaded_calls = 0
+        self.offloaded_bytes = 0
+        self.inline_calls = 0
+        self.executor_time = 0.0
+        self.blocked_time = 0.0
+
+        self._running = 0
+        self._probe = None
+        self._probe_deadline = 0.0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} threshold={self.threshold}>'
+
+    @property
+    def time_saved(self):
+        """The executor time during which the event loop was free to run."""
+        return max(self.executor_time - self.blocked_time, 0.0)
+
+    def should_offload(self, size):
+        return size >= self.threshold
+
+    def run_inline(self, func, *args):
+        self.inline_calls += 1
+        return func(*args)
+
+    async def run(self, loop, size, func, *args):
+        """Runs func(*args), in the executor if size reaches the threshold."""
+        if not self.should_offload(size):
+            return self.run_inline(func, *args)
+
+        self._start_probe(loop)
+        try:
+            result, elapsed = await loop.run_in_executor(self.executor, _timed, func, args)
+        finally:
+            self._stop_probe(loop)
+
+        self.offloaded_calls += 1
+        self.offloaded_bytes += size
+        self.executor_time += elapsed
+
+        return result
+
+    def _start_probe(self, loop):
+        self._running += 1
+        if self._running == 1:
+            self._schedule_probe(loop, loop.time())
+
+    def _schedule_probe(self, loop, now):
+        self._probe_deadline = now + self.probe_interval
+        self._probe = loop.call_at(self._probe_deadline, self._check_probe, loop)
+
+    def _check_probe(self, loop):
+        # The timer fires late by as long as something held the loop past its deadline
+        now = loop.time()
+        self.blocked_time += max(now - self._probe_deadline, 0.0)
+        self._schedule_probe(loop, now)
+
+    def _stop_probe(self, loop):
+        self._running -= 1
+        if self._running == 0:
+            self._probe.cancel()
+            self._probe = None
+
+            self.blocked_time += max(loop.time() - self._probe_deadline, 0.0)
+
+    def get_stats(self):
+        return {
+            'offloaded_calls': self.offloaded_calls,
+            'offloaded_bytes': self.offloaded_bytes,
+            'inline_calls': self.inline_calls,
+            'executor_time': self.executor_time,
+            'blocked_time': self.blocked_time,
+            'time_saved': self.time_saved,
+        }
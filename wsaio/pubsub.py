@@ -0,0 +1,293 @@
+import asyncio
+import os
+import struct
+
+from .connection import encode_payload
+
+_RECORD = struct.Struct('<?HI')
+_HELLO = struct.Struct('<H')
+
+_LARGE_TOPIC_MSG = 'The topic should be at most 65535 bytes when encoded'
+_LARGE_RECORD_MSG = 'The message should be at most 4 GiB to be sent to other workers'
+
+
+class PubSub:
+    """An in-process index of topics and the writers subscribed to them.
+
+    A published message is written to each subscriber with
+    `WebSocketWriter.write_nowait`, which keeps each subscriber's messages
+    in order. Subscribers whose stream has closed are removed when a
+    message is published.
+
+    Attributes:
+        published (int): The number of messages published.
+
+        delivered (int): The number of messages written to subscribers.
+    """
+
+    def __init__(self):
+        self._topics = {}
+        self._subscriptions = {}
+
+        self.published = 0
+        self.delivered = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} topics={len(self._topics)}>'
+
+    def subscribe(self, topic, writer):
+        """Subscribes a writer to a topic.
+
+        Arguments:
+            topic (str): The topic.
+
+            writer (WebSocketWriter): The writer, e.g. a client's writer.
+        """
+        self._topics.setdefault(topic, {})[writer] = None
+        self._subscriptions.setdefault(writer, set()).add(topic)
+
+    def unsubscribe(self, topic, writer):
+        subscribers = self._topics.get(topic)
+        if subscribers is None or writer not in subscribers:
+            return
+
+        del subscribers[writer]
+        if not subscribers:
+            del self._topics[topic]
+
+        topics = self._subscriptions[writer]
+        topics.discard(topic)
+        if not topics:
+            del self._subscriptions[writer]
+
+    def unsubscribe_all(self, writer):
+        for topic in list(self._subscriptions.get(writer, ())):
+            self.unsubscribe(topic, writer)
+
+    def get_subscribers(self, topic):
+        return list(self._topics.get(topic, ()))
+
+    def get_topics(self):
+        return list(self._topics)
+
+    def publish(self, topic, data, *, binary=False):
+        """Writes a message to the local subscribers of a topic.
+
+        This doesn't wait for the subscribers' streams to drain, a subscriber
+        that can't keep up buffers the messages in its transport.
+
+        Arguments:
+            topic (str): The topic.
+
+            data (str | int | BytesLike): The data to send in the message.
+
+            binary (bool): Whether to send the message with the binary opcode.
+
+        Returns:
+            int: The number of subscribers the message was written to.
+        """
+        self.published += 1
+
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return 0
+
+        data = encode_payload(data)
+
+        closed = None
+        count = 0
+
+        for writer in subscribers:
+            if writer.stream.is_closing():
+                if closed is None:
+                    closed = []
+                closed.append(writer)
+            else:
+                writer.write_nowait(data, binary=binary)
+                count += 1
+
+        if closed is not None:
+            for writer in closed:
+                self.unsubscribe_all(writer)
+
+        self.delivered += count
+        return count
+
+
+class PubSubBus:
+    """A bus that links the `PubSub` of several worker processes on one host.
+
+    Every worker listens on a Unix domain socket in a shared directory and
+    connects to the sockets of the workers that started before it. A
+    published message is sent once to each other worker, which writes it
+    to its own local subscribers.
+
+    Arguments:
+        pubsub (PubSub): The local topic index.
+
+        path (str | os.PathLike): The directory of the workers' sockets.
+
+        name (Optional[str]): The worker's unique name, defaults to its process ID.
+
+    Attributes:
+        sent (int): The number of messages sent to other workers.
+
+        received (int): The number of messages received from other workers.
+    """
+
+    def __init__(self, pubsub, *, path, name=None):
+        self.pubsub = pubsub
+        self.path = os.fspath(path)
+        self.name = str(os.getpid()) if name is None else name
+
+        self.sent = 0
+        self.received = 0
+
+        self._server = None
+        self._peers = {}
+        self._tasks = set()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} name={self.name!r} peers={len(self._peers)}>'
+
+    @property
+    def address(self):
+        return os.path.join(self.path, f'{self.name}.sock')
+
+    def get_peers(self):
+        return list(self._peers)
+
+    async def start(self):
+        """Starts listening for workers and connects to the running ones."""
+        os.makedirs(self.path, exist_ok=True)
+
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+        self._server = await asyncio.start_unix_server(self._accept, self.address)
+
+        for entry in os.listdir(self.path):
+            name, ext = os.path.splitext(entry)
+            if ext != '.sock' or name == self.name:
+                continue
+
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    os.path.join(self.path, entry)
+                )
+            except OSError:
+                # The socket of a worker that has exited
+                continue
+
+            encoded_name = self.name.encode('utf-8')
+            writer.write(_HELLO.pack(len(encoded_name)) + encoded_name)
+
+            self._add_peer(name, self.name, reader, writer)
+
+    async def close(self):
+        for writer, _ in self._peers.values():
+            writer.close()
+
+        self._peers.clear()
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+
+    async def _accept(self, reader, writer):
+        try:
+            length, = _HELLO.unpack(await reader.readexactly(_HELLO.size))
+            name = (await reader.readexactly(length)).decode('utf-8')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+
+        self._add_peer(name, name, reader, writer)
+
+    def _add_peer(self, name, initiator, reader, writer):
+        existing = self._peers.get(name)
+        if existing is not None:
+            # Two workers that start together connect to each other twice,
+            # both sides keep the link started by the worker with the lower name
+            if initiator != min(self.name, name):
+                writer.close()
+                return
+
+            existing[0].close()
+
+        self._peers[name] = (writer, initiator)
+
+        task = asyncio.get_running_loop().create_task(self._read_peer(name, reader, writer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _read_peer(self, name, reader, writer):
+        try:
+            while True:
+                binary, topic_length, length = _RECORD.unpack(
+                    await reader.readexactly(_RECORD.size)
+                )
+
+                topic = (await reader.readexactly(topic_length)).decode('utf-8')
+                data = await reader.readexactly(length)
+
+                self.received += 1
+                self.pubsub.publish(topic, data, binary=binary)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            peer = self._peers.get(name)
+            if peer is not None and peer[0] is writer:
+                del self._peers[name]
+
+            writer.close()
+
+    def publish(self, topic, data, *, binary=False):
+        """Publishes a message to the subscribers of every worker.
+
+        Arguments:
+            topic (str): The topic.
+
+            data (str | int | BytesLike): The data to send in the message.
+
+            binary (bool): Whether to send the message with the binary opcode.
+
+        Returns:
+            int: The number of local subscribers the message was written to.
+
+        Raises:
+            ValueError: The topic or the message is too large to send to
+                other workers.
+        """
+        data = encode_payload(data)
+
+        if self._peers:
+            encoded_topic = topic.encode('utf-8')
+            if len(encoded_topic) > 0xFFFF:
+                raise ValueError(_LARGE_TOPIC_MSG)
+
+            if len(data) > 0xFFFFFFFF:
+                raise ValueError(_LARGE_RECORD_MSG)
+
+            record = b''.join(
+                (_RECORD.pack(binary, len(encoded_topic), len(data)), encoded_topic, data)
+            )
+
+            for writer, _ in self._peers.values():
+                if not writer.is_closing():
+                    writer.write(record)
+                    self.sent += 1
+
+        return self.pubsub.publish(topic, data, binary=binary)
+
+    async def drain(self):
+        """Waits until the messages sent to other workers have been flushed."""
+        for writer, _ in list(self._peers.values()):
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
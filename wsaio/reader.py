@@ -1,201 +1,269 @@
-from codecs import getincrementaldecoder
-from contextlib import contextmanager
-from io import BytesIO, StringIO
+import codecs
+import time
+from collections import deque
 
 from . import frame as wsframe
-from . import util
+from .connection import WebSocketConnection
 from .exceptions import InvalidFrameError
 
-_INVALID_OPCODE_MSG = 'The WebSocket received a frame with an invalid or unknown opcode: {!r}'
-_MISSING_CLOSE_CODE_MSG = 'The WebSocket received a close frame with payload data but no close code'
-_INVALID_CLOSE_CODE_MSG = (
-    'The WebSocket received a close frame with an invalid or unknown close code: {!r}'
-)
-
-_INVALID_LENGTH_MSG = (
-    'The WebSocket received a frame with an invalid non-extended payload length: {!r}'
-)
-_LARGE_CONTROL_MSG = (
-    'The WebSocket received a control frame with a payload length that exceeds 125: {!r}'
-)
-
-_FRAGMENTED_CONTROL_MSG = 'The WebSocket received a fragmented control frame'
-_MEANINGLESS_RSV_BITS_MSG = (
-    'The WebSocket received a frame with a reserved bit set but no meaning was negotiated'
-)
 _NON_UTF_8_MSG = 'The WebSocket received a text or close frame with non-UTF-8 payload data'
+_UNDECODABLE_MSG = 'The WebSocket received a message that the codec could not decode'
 
-_EXPECTED_CONT_MSG = (
-    'The WebSocket received a non-continuation data frame while reading a fragmented frame'
-)
-_UNEXPECTED_CONT_MSG = (
-    'The WebSocket received a continuation frame but no fragmented frame was received'
-)
+DECODE_CHUNK_SIZE = 1 << 16
 
-_IncrementalDecoder = getincrementaldecoder('utf-8')
 
+def decode_utf8(data, *, keep=True):
+    """Decodes UTF-8 one chunk at a time, releasing the GIL after every chunk
+    so that a thread running this doesn't hold up the event loop.
 
-class WebSocketReader:
-    """A class for reading WebSocket frames from a stream."""
+    Arguments:
+        data (BytesLike): The data to decode.
 
-    def __init__(self, *, stream):
-        self.stream = stream
+        keep (bool): Whether to return the decoded text, if False the data
+            is only validated and each decoded chunk is dropped.
 
-        self._fragment_buffer = None
-        self._fragment_decoder = None
-        self._fragmented_frame = None
+    Raises:
+        UnicodeDecodeError: The data is not valid UTF-8.
+    """
+    if len(data) <= DECODE_CHUNK_SIZE:
+        text = data.decode('utf-8')
+        return text if keep else None
 
-        self._on_ping = None
-        self._on_pong = None
-        self._on_text = None
-        self._on_binary = None
-        self._on_close = None
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
 
-    def __repr__(self):
-        return f'<{self.__class__.__name__} stream={self.stream!r}>'
+    with memoryview(data) as view:
+        for start in range(0, len(data), DECODE_CHUNK_SIZE):
+            text = decoder.decode(view[start:start + DECODE_CHUNK_SIZE])
+            if keep:
+                parts.append(text)
+            time.sleep(0)
 
-    @contextmanager
-    def _suppress_decode_error(self):
-        try:
-            yield
-        except UnicodeDecodeError:
-            raise InvalidFrameError(_NON_UTF_8_MSG, wsframe.WS_INVALID_PAYLOAD_DATA)
-
-    def _run_callback(self, frame):
-        if frame.is_ping():
-            coro = self._on_ping(frame.data)
-        elif frame.is_pong():
-            coro = self._on_pong(frame.data)
-        elif frame.is_text():
-            coro = self._on_text(frame.data)
-        elif frame.is_binary():
-            coro = self._on_binary(frame.data)
-        elif frame.is_close():
-            coro = self._on_close(frame.code, frame.data)
+    decoder.decode(b'', final=True)
+    return ''.join(parts) if keep else None
 
-        self.stream.loop.create_task(coro)
 
-    def _setup_fragmenter(self, frame, data):
-        self._fragmented_frame = frame
-        if frame.is_text():
-            self._fragment_decoder = _IncrementalDecoder()
-            self._fragment_buffer = StringIO()
-        else:
-            self._fragment_buffer = BytesIO()
+def decode_payload(data, text_mode, validate, decoder):
+    """Converts a data frame payload to what handlers receive.
 
-        self._write_fragment(data)
+    This is a plain function so that it can be sent to an executor,
+    including a process pool if the decoder can be pickled.
 
-    def _write_fragment(self, data):
-        if self._fragment_decoder is not None:
-            data = self._fragment_decoder.decode(data)
-        self._fragment_buffer.write(data)
+    Arguments:
+        data (bytes): The payload.
 
-    def _reset_fragmenter(self):
-        self._fragmented_frame = None
-        self._fragment_buffer = None
-        self._fragment_decoder = None
+        text_mode (Optional[str]): The text mode for text payloads, None
+            for binary payloads or text that was already decoded.
 
-    def read_frame(self, ctx):
-        fbyte, sbyte = yield from ctx.read(2)
+        validate (bool): Whether to validate text payloads in 'bytes' mode.
 
-        masked = (sbyte >> 7) & 1
-        length = sbyte & ~(1 << 7)
+        decoder (Optional[Callable[[bytes], Any]]): A codec's decode function.
 
-        frame = wsframe.WebSocketFrame.from_head(fbyte)
+    Raises:
+        UnicodeDecodeError: The payload is text and is not valid UTF-8.
 
-        if frame.op not in wsframe.WS_OPS:
-            raise InvalidFrameError(_INVALID_OPCODE_MSG.format(frame.op), wsframe.WS_PROTOCOL_ERROR)
+        ValueError: The decoder could not decode the payload.
+    """
+    if text_mode == 'str':
+        data = decode_utf8(data)
+    elif text_mode == 'bytes' and validate and not data.isascii():
+        decode_utf8(data, keep=False)
 
-        if any((frame.rsv1, frame.rsv2, frame.rsv3)):
-            raise InvalidFrameError(_MEANINGLESS_RSV_BITS_MSG, wsframe.WS_PROTOCOL_ERROR)
+    if decoder is not None:
+        data = decoder(data)
 
-        if frame.is_control():
-            yield from self._handle_control_frame(ctx, frame, masked, length)
-        else:
-            yield from self._handle_data_frame(ctx, frame, masked, length)
+    return data
 
-    def _read_length(self, ctx, length):
-        if length == 126:
-            data = yield from ctx.read(2)
-        elif length == 127:
-            data = yield from ctx.read(8)
-        else:
-            if length > 127:  # XXX: Is this even possible?
-                raise InvalidFrameError(_INVALID_LENGTH_MSG, wsframe.WS_PROTOCOL_ERROR)
 
-            return length
+def _convert_decode_error(exc):
+    if isinstance(exc, UnicodeDecodeError):
+        return InvalidFrameError(_NON_UTF_8_MSG, wsframe.WS_INVALID_PAYLOAD_DATA)
+    return InvalidFrameError(_UNDECODABLE_MSG, wsframe.WS_INVALID_PAYLOAD_DATA)
 
-        return int.from_bytes(data, 'big', signed=False)
 
-    def _read_payload(self, ctx, length, masked):
-        if masked:
-            mask = yield from ctx.read(4)
-            data = yield from ctx.read(length)
-            return util.mask(data, mask)
-        else:
-            data = yield from ctx.read(length)
-            return data
+class WebSocketReader:
+    """A class for reading WebSocket frames from a stream.
+
+    The frames are parsed by a `WebSocketConnection`, the reader feeds it
+    the data received by the stream and delivers its events to callbacks.
+
+    Arguments:
+        stream (Stream): The stream to read frames from.
+
+        connection (Optional[WebSocketConnection]): The connection that parses
+            frames, one is created from text_mode and validate_utf8 if omitted.
+
+        text_mode (str): How text payloads are delivered, 'str' decodes them
+            and 'bytes' passes the raw UTF-8 bytes through.
+
+        validate_utf8 (bool): Whether to validate text payloads in 'bytes' mode,
+            this should only be disabled for trusted peers.
+
+        codec (Optional[MessageCodec]): A codec that decodes the payload of
+            messages with its opcode before they are delivered.
+
+        offload (Optional[OffloadPolicy]): The policy for processing large
+            payloads in an executor, messages are still delivered in order.
+            Text is only decoded in the executor if the connection was
+            created with decode_text=False.
+
+        monitor (Optional[LoopMonitor]): A monitor that measures how long
+            each callback holds the event loop.
+    """
+
+    __slots__ = (
+        'stream',
+        'connection',
+        'codec',
+        'offload',
+        'monitor',
+        '_deliveries',
+        '_delivery_task',
+        '_on_ping',
+        '_on_pong',
+        '_on_text',
+        '_on_binary',
+        '_on_close',
+    )
+
+    def __init__(
+        self, *, stream, connection=None, text_mode='str', validate_utf8=True, codec=None,
+        offload=None, monitor=None
+    ):
+        if connection is None:
+            connection = WebSocketConnection(
+                text_mode=text_mode, validate_utf8=validate_utf8, decode_text=offload is None
+            )
 
-    def _set_close_code(self, frame, data):
-        if not data:
-            return b''
-        elif len(data) < 2:
-            raise InvalidFrameError(_MISSING_CLOSE_CODE_MSG, wsframe.WS_PROTOCOL_ERROR)
+        self.stream = stream
+        self.connection = connection
+        self.codec = codec
+        self.offload = offload
+        self.monitor = monitor
 
-        code = int.from_bytes(data[:2], 'big', signed=False)
+        # Only connections that ever queue a delivery pay for the deque
+        self._deliveries = None
+        self._delivery_task = None
 
-        if not wsframe.is_close_code(code):
-            raise InvalidFrameError(_INVALID_CLOSE_CODE_MSG.format(code), wsframe.WS_PROTOCOL_ERROR)
+        self._on_ping = None
+        self._on_pong = None
+        self._on_text = None
+        self._on_binary = None
+        self._on_close = None
 
-        frame.set_code(code)
+    def __repr__(self):
+        return f'<{self.__class__.__name__} stream={self.stream!r}>'
 
-        return data[2:]
+    def _run_callback(self, event, data):
+        op = event.op
 
-    def _handle_control_frame(self, ctx, frame, masked, length):
-        if not frame.fin:
-            raise InvalidFrameError(_FRAGMENTED_CONTROL_MSG, wsframe.WS_PROTOCOL_ERROR)
+        if op == wsframe.OP_TEXT:
+            coro = self._on_text(data)
+        elif op == wsframe.OP_BINARY:
+            coro = self._on_binary(data)
+        elif op == wsframe.OP_PING:
+            coro = self._on_ping(data)
+        elif op == wsframe.OP_PONG:
+            coro = self._on_pong(data)
+        elif op == wsframe.OP_CLOSE:
+            coro = self._on_close(event.code, data)
 
-        if length > 125:
-            raise InvalidFrameError(_LARGE_CONTROL_MSG.format(length), wsframe.WS_PROTOCOL_ERROR)
+        if self.monitor is not None:
+            coro = self.monitor.wrap(coro, self.stream, op)
 
-        data = yield from self._read_payload(ctx, length, masked)
+        self.stream.loop.create_task(coro)
 
-        if frame.is_close():
-            data = self._set_close_code(frame, data)
+    def _get_decode_args(self, event):
+        if event.op == wsframe.OP_TEXT and not self.connection.decode_text:
+            text_mode = self.connection.text_mode
+        else:
+            text_mode = None
 
-            with self._suppress_decode_error():
-                frame.set_data(data.decode('utf-8'))
+        if self.codec is not None and self.codec.binary == (event.op == wsframe.OP_BINARY):
+            decoder = self.codec.decode
         else:
-            frame.set_data(data)
+            decoder = None
 
-        self._run_callback(frame)
+        if text_mode is None and decoder is None:
+            return None
 
-    def _handle_data_frame(self, ctx, frame, masked, length):
-        length = yield from self._read_length(ctx, length)
-        data = yield from self._read_payload(ctx, length, masked)
+        return text_mode, self.connection.validate_utf8, decoder
 
-        if frame.is_continuation():
-            if self._fragmented_frame is None:
-                raise InvalidFrameError(_UNEXPECTED_CONT_MSG, wsframe.WS_PROTOCOL_ERROR)
+    def _deliver(self, event):
+        """Delivers an event to its callback.
 
-            with self._suppress_decode_error():
-                self._write_fragment(data)
-        elif self._fragmented_frame is not None:
-            raise InvalidFrameError(_EXPECTED_CONT_MSG, wsframe.WS_PROTOCOL_ERROR)
+        The payload is processed inline unless an offload policy is set
+        and the payload is large, or earlier payloads are still being
+        processed, in which case it is queued behind them.
+        """
+        data = event.data
 
-        if not frame.fin:
-            if self._fragmented_frame is None:
-                with self._suppress_decode_error():
-                    self._setup_fragmenter(frame, data)
+        if event.op > 0x7:
+            args = None
         else:
-            if self._fragmented_frame is not None:
-                frame = self._fragmented_frame
-                data = self._fragment_buffer.getvalue()
-                self._reset_fragmenter()
-            elif frame.is_text():
-                with self._suppress_decode_error():
-                    data = data.decode('utf-8')
+            args = self._get_decode_args(event)
 
-            frame.set_data(data)
+        if self._deliveries or (
+            args is not None
+            and self.offload is not None
+            and self.offload.should_offload(len(data))
+        ):
+            self._queue_delivery(event, args)
+            return
 
-            self._run_callback(frame)
+        if args is not None:
+            try:
+                if self.offload is not None:
+                    data = self.offload.run_inline(decode_payload, data, *args)
+                else:
+                    data = decode_payload(data, *args)
+            except ValueError as exc:
+                raise _convert_decode_error(exc) from None
+
+        self._run_callback(event, data)
+
+    def _queue_delivery(self, event, args):
+        if self._deliveries is None:
+            self._deliveries = deque()
+
+        self._deliveries.append((event, args))
+
+        if self._delivery_task is None:
+            self._delivery_task = self.stream.loop.create_task(self._process_deliveries())
+
+    async def _process_deliveries(self):
+        loop = self.stream.loop
+
+        try:
+            while self._deliveries:
+                event, args = self._deliveries[0]
+                data = event.data
+
+                if args is not None:
+                    try:
+                        data = await self.offload.run(
+                            loop, len(data), decode_payload, data, *args
+                        )
+                    except ValueError as exc:
+                        self._deliveries.clear()
+                        self.stream.report_error(_convert_decode_error(exc))
+                        return
+
+                self._deliveries.popleft()
+                self._run_callback(event, data)
+        finally:
+            self._delivery_task = None
+
+    def read_frame(self, ctx):
+        buffer = ctx.get_buffer()
+        if buffer:
+            self.connection.receive_data(buffer)
+            buffer.clear()
+
+        # The parser stays suspended between chunks rather than being recreated
+        while True:
+            for event in self.connection.events():
+                self._deliver(event)
+
+            data = yield
+            self.connection.receive_data(data)
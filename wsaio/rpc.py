@@ -0,0 +1,256 @@
+import asyncio
+import bisect
+import itertools
+import time
+
+from .timer import get_timer_wheel
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_dict_id(message, key='id'):
+    if isinstance(message, dict):
+        return message.get(key)
+    return None
+
+
+def set_dict_id(payload, call_id, key='id'):
+    if not isinstance(payload, dict):
+        raise TypeError(f'payload should be a dict, got {type(payload).__name__!r}')
+
+    return {**payload, key: call_id}
+
+
+class LatencyHistogram:
+    """A histogram of call latencies with fixed bucket boundaries.
+
+    Arguments:
+        buckets (Sequence[float]): The upper bounds of the buckets in
+            seconds, latencies above the last bound are counted separately.
+
+    Attributes:
+        count (int): The number of latencies recorded.
+
+        total (float): The sum of the latencies recorded.
+
+        max (float): The largest latency recorded.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} count={self.count}>'
+
+    def record(self, latency):
+        self.counts[bisect.bisect_left(self.buckets, latency)] += 1
+
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, percent):
+        """Returns the upper bound of the bucket that contains the percentile,
+        or the largest latency if it is above the last bucket.
+
+        Arguments:
+            percent (float): The percentile, between 0 and 100.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = self.count * percent / 100
+        seen = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return self.max
+
+    def get_stats(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': dict(zip(self.buckets + (float('inf'),), self.counts)),
+        }
+
+
+class RPCManager:
+    """Matches replies to calls sent over a single connection.
+
+    Every call is given a unique correlation ID that is added to its payload
+    and replies are matched to calls by extracting the ID. Any number of
+    calls can be in flight at once up to the limit, further calls wait for
+    a slot. Messages that are not replies to a pending call are delivered
+    to the usual callbacks.
+
+    A manager keeps the state of one connection, so each client needs its own.
+
+    The default get_id and set_id work with dicts, so a client needs a codec
+    such as `JSONCodec` to use them. A client without a codec sends and
+    receives str and bytes, which get_id and set_id must then handle.
+
+    Arguments:
+        max_in_flight (int): The maximum number of calls awaiting a reply.
+
+        timeout (Optional[float]): The default timeout of a call in seconds.
+
+        get_id (Callable[[Any], Any]): Returns the correlation ID of a received
+            message, or None if it isn't a reply. The message is decoded by
+            the client's codec if it has one. The default reads the 'id'
+            key of dicts.
+
+        set_id (Callable[[Any, int], Any]): Returns the payload to send with
+            the correlation ID added. The default sets the 'id' key of a copy
+            of the dict.
+
+        buckets (Sequence[float]): The bucket bounds of the latency histogram.
+
+    Attributes:
+        calls (int): The number of calls sent.
+
+        replies (int): The number of calls that received a reply.
+
+        timeouts (int): The number of calls that timed out.
+
+        latency (LatencyHistogram): The latency of the calls that received a reply.
+    """
+
+    def __init__(
+        self, *, max_in_flight=100, timeout=30, get_id=get_dict_id, set_id=set_dict_id,
+        buckets=DEFAULT_BUCKETS
+    ):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.get_id = get_id
+        self.set_id = set_id
+
+        self.calls = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.latency = LatencyHistogram(buckets)
+
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._semaphore = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} in_flight={len(self._pending)}>'
+
+    def get_in_flight(self):
+        return len(self._pending)
+
+    def uses_dicts(self):
+        """Returns whether the manager uses the default dict get_id or set_id."""
+        return self.get_id is get_dict_id or self.set_id is set_dict_id
+
+    async def call(self, loop, send, payload, *, timeout=None):
+        """Sends a call and waits for its reply.
+
+        Arguments:
+            loop (asyncio.AbstractEventLoop): The event loop.
+
+            send (Callable[[Any], Awaitable]): Sends a payload over the connection.
+
+            payload (Any): The payload of the call, without a correlation ID.
+
+            timeout (Optional[float]): The timeout, defaults to `self.timeout`.
+
+        Returns:
+            Any: The reply.
+
+        Raises:
+            asyncio.TimeoutError: No reply was received in time.
+
+            ConnectionError: The connection was closed before the reply was received.
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async with self._semaphore:
+            call_id = next(self._ids)
+            message = self.set_id(payload, call_id)
+
+            future = self._pending[call_id] = loop.create_future()
+            timer = None
+
+            self.calls += 1
+
+            try:
+                start = time.perf_counter()
+                await send(message)
+
+                if timeout is not None:
+                    timer = get_timer_wheel(loop).call_later(timeout, self._expire, call_id)
+
+                reply = await future
+            finally:
+                self._pending.pop(call_id, None)
+                if timer is not None:
+                    timer.cancel()
+
+            self.latency.record(time.perf_counter() - start)
+            return reply
+
+    def _expire(self, call_id):
+        future = self._pending.pop(call_id, None)
+        if future is not None and not future.done():
+            self.timeouts += 1
+            future.set_exception(asyncio.TimeoutError(f'The call {call_id} timed out'))
+
+    def resolve(self, message):
+        """Completes the call a received message replies to.
+
+        Returns:
+            bool: Whether the message was a reply to a pending call.
+        """
+        if not self._pending:
+            return False
+
+        call_id = self.get_id(message)
+
+        try:
+            future = self._pending.pop(call_id, None)
+        except TypeError:
+            # An unhashable ID, e.g. a list, can't belong to a call
+            return False
+
+        if future is None or future.done():
+            return False
+
+        self.replies += 1
+        future.set_result(message)
+
+        return True
+
+    def fail_all(self, exc):
+        """Fails every pending call with an exception."""
+        pending = list(self._pending.values())
+        self._pending.clear()
+
+        for future in pending:
+            if not future.done():
+                future.set_exception(exc)
+
+    def get_stats(self):
+        return {
+            'calls': self.calls,
+            'replies': self.replies,
+            'timeouts': self.timeouts,
+            'in_flight': len(self._pending),
+            'latency': self.latency.get_stats(),
+        }
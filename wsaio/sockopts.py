@@ -0,0 +1,209 @@
+import socket
+
+
+class SocketOptions:
+    """Options for tuning the socket of a connection.
+
+    The options are applied before the socket connects, so they are in
+    effect from the handshake onwards. Options the platform does not
+    support, or that the process isn't permitted to set (e.g. SO_BUSY_POLL
+    without CAP_NET_ADMIN), are skipped.
+
+    Arguments:
+        nodelay (bool): Whether to disable Nagle's algorithm (TCP_NODELAY).
+
+        send_buffer_size (Optional[int]): The kernel send buffer size (SO_SNDBUF).
+
+        receive_buffer_size (Optional[int]): The kernel receive buffer size (SO_RCVBUF).
+
+        keepalive (bool): Whether to enable TCP keepalive (SO_KEEPALIVE).
+
+        keepalive_idle (Optional[int]): The number of idle seconds before
+            keepalive probes are sent (TCP_KEEPIDLE).
+
+        keepalive_interval (Optional[int]): The number of seconds between
+            keepalive probes (TCP_KEEPINTVL).
+
+        keepalive_count (Optional[int]): The number of unanswered probes
+            before the connection is dropped (TCP_KEEPCNT).
+
+        user_timeout (Optional[float]): The number of seconds sent data may
+            remain unacknowledged before the connection is dropped (TCP_USER_TIMEOUT).
+
+        busy_poll (Optional[int]): The number of microseconds to busy poll
+            the device queue on reads (SO_BUSY_POLL).
+
+        write_buffer_high (Optional[int]): The transport's high watermark,
+            writers wait for the buffer to drain once it is exceeded.
+
+        write_buffer_low (Optional[int]): The transport's low watermark.
+    """
+
+    def __init__(
+        self, *, nodelay=True, send_buffer_size=None, receive_buffer_size=None,
+        keepalive=False, keepalive_idle=None, keepalive_interval=None, keepalive_count=None,
+        user_timeout=None, busy_poll=None, write_buffer_high=None, write_buffer_low=None
+    ):
+        self.nodelay = nodelay
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+
+        self.user_timeout = user_timeout
+        self.busy_poll = busy_poll
+
+        self.write_buffer_high = write_buffer_high
+        self.write_buffer_low = write_buffer_low
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} nodelay={self.nodelay} keepalive={self.keepalive}>'
+
+    def get_options(self):
+        """Returns the (level, option, value) socket options to set, without
+        the ones the platform does not support.
+        """
+        options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))]
+
+        if self.send_buffer_size is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size))
+
+        if self.receive_buffer_size is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size))
+
+        if self.keepalive:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+
+            for name, value in (
+                ('TCP_KEEPIDLE', self.keepalive_idle),
+                ('TCP_KEEPINTVL', self.keepalive_interval),
+                ('TCP_KEEPCNT', self.keepalive_count),
+            ):
+                if value is not None and hasattr(socket, name):
+                    options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+
+        if self.user_timeout is not None and hasattr(socket, 'TCP_USER_TIMEOUT'):
+            options.append(
+                (socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(self.user_timeout * 1000))
+            )
+
+        if self.busy_poll is not None and hasattr(socket, 'SO_BUSY_POLL'):
+            options.append((socket.SOL_SOCKET, socket.SO_BUSY_POLL, self.busy_poll))
+
+        return options
+
+    def apply(self, sock):
+        """Sets the options on a socket.
+
+        Arguments:
+            sock (socket.socket): The socket.
+
+        Returns:
+            list[tuple[int, int, int]]: The options that the socket rejected.
+        """
+        rejected = []
+
+        for level, option, value in self.get_options():
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError:
+                rejected.append((level, option, value))
+
+        return rejected
+
+    def apply_transport(self, transport):
+        """Sets the options that belong to the transport rather than the socket.
+
+        Arguments:
+            transport (asyncio.Transport): The transport.
+        """
+        sock = transport.get_extra_info('socket')
+        if sock is not None and not self.nodelay:
+            # asyncio enables TCP_NODELAY on every transport it creates
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+
+        if self.write_buffer_high is not None or self.write_buffer_low is not None:
+            transport.set_write_buffer_limits(self.write_buffer_high, self.write_buffer_low)
+
+    async def connect(self, loop, host, port):
+        """Creates a socket with the options set and connects it.
+
+        Arguments:
+            loop (asyncio.AbstractEventLoop): The event loop.
+
+            host (str): The host to connect to.
+
+            port (int): The port to connect to.
+
+        Returns:
+            socket.socket: The connected non-blocking socket.
+
+        Raises:
+            OSError: None of the host's addresses could be connected to.
+        """
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        if not infos:
+            raise OSError(f'getaddrinfo() returned an empty list for {host!r}')
+
+        error = None
+
+        for family, type, proto, _, address in infos:
+            sock = socket.socket(family, type, proto)
+
+            try:
+                sock.setblocking(False)
+                self.apply(sock)
+                await loop.sock_connect(sock, address)
+            except OSError as exc:
+                sock.close()
+                error = exc
+            except BaseException:
+                sock.close()
+                raise
+            else:
+                return sock
+
+        raise error
+
+    def connect_blocking(self, host, port, *, timeout=None):
+        """Creates a socket with the options set and connects it, blocking.
+
+        Arguments:
+            host (str): The host to connect to.
+
+            port (int): The port to connect to.
+
+            timeout (Optional[float]): The timeout for each connection attempt.
+
+        Returns:
+            socket.socket: The connected socket, with the timeout set.
+
+        Raises:
+            OSError: None of the host's addresses could be connected to.
+        """
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        if not infos:
+            raise OSError(f'getaddrinfo() returned an empty list for {host!r}')
+
+        error = None
+
+        for family, type, proto, _, address in infos:
+            sock = socket.socket(family, type, proto)
+
+            try:
+                sock.settimeout(timeout)
+                self.apply(sock)
+                sock.connect(address)
+            except OSError as exc:
+                sock.close()
+                error = exc
+            except BaseException:
+                sock.close()
+                raise
+            else:
+                return sock
+
+        raise error
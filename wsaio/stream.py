@@ -1,10 +1,39 @@
 import asyncio
+import weakref
 
 from .exceptions import InvalidDataError
+from .loops import is_uvloop
 from .util import getbytes
 
+RECEIVE_BUFFER_SIZE = 1 << 16
+
+_receive_buffers = weakref.WeakKeyDictionary()
+
+
+def get_receive_buffer(loop):
+    """Returns the receive buffer shared by the buffered protocols of an event loop.
+
+    The loop fills the buffer and passes it to a protocol in one step, so it
+    is never in use by two connections at once.
+    """
+    buffer = _receive_buffers.get(loop)
+    if buffer is None:
+        buffer = _receive_buffers[loop] = memoryview(bytearray(RECEIVE_BUFFER_SIZE))
+    return buffer
+
 
 class StreamProtocol(asyncio.Protocol):
+    __slots__ = (
+        'loop',
+        'transport',
+        '_stream',
+        '_over_ssl',
+        '_paused',
+        '_connection_lost',
+        '_drain_waiter',
+        '_close_waiter',
+    )
+
     def __init__(self, stream):
         self.loop = stream.loop
         self.transport = None
@@ -16,8 +45,7 @@ class StreamProtocol(asyncio.Protocol):
         self._paused = False
         self._connection_lost = False
         self._drain_waiter = None
-
-        self._close_waiter = self.loop.create_future()
+        self._close_waiter = None
 
     def connection_made(self, transport):
         self.transport = transport
@@ -38,7 +66,11 @@ class StreamProtocol(asyncio.Protocol):
             self._drain_waiter = None
 
     def data_received(self, data):
-        self._stream._ctx.feed_data(data)
+        stream = self._stream
+        if stream._capture is not None:
+            stream._capture.record(data)
+
+        stream._ctx.feed_data(data)
 
     def eof_received(self):
         self._stream._ctx.feed_eof()
@@ -49,6 +81,10 @@ class StreamProtocol(asyncio.Protocol):
     def connection_lost(self, exc):
         self._connection_lost = True
 
+        if exc is not None:
+            # A reset isn't preceded by an EOF, the parser still expects data
+            self._stream._ctx.feed_connection_lost(exc)
+
         if self._paused and self._drain_waiter is not None:
             if not self._drain_waiter.done():
                 if exc is not None:
@@ -56,6 +92,9 @@ class StreamProtocol(asyncio.Protocol):
                 else:
                     self._drain_waiter.set_result(None)
 
+        if self._close_waiter is None:
+            self._close_waiter = self.loop.create_future()
+
         if not self._close_waiter.done():
             if exc is not None:
                 self._close_waiter.set_exception(exc)
@@ -69,16 +108,52 @@ class StreamProtocol(asyncio.Protocol):
             raise ConnectionResetError('Connection lost')
 
         if self._paused:
-            assert self._drain_waiter is None or self._drain_waiter.cancelled()
+            # The waiter is shared by concurrent writers
+            if self._drain_waiter is None or self._drain_waiter.done():
+                self._drain_waiter = self.loop.create_future()
 
-            self._drain_waiter = self.loop.create_future()
-            await self._drain_waiter
+            await asyncio.shield(self._drain_waiter)
 
     async def wait_until_closed(self):
+        if self._close_waiter is None:
+            self._close_waiter = self.loop.create_future()
+
         await self._close_waiter
 
 
+class BufferedStreamProtocol(StreamProtocol, asyncio.BufferedProtocol):
+    """A stream protocol that the event loop reads into directly.
+
+    Reads go into the loop's shared receive buffer instead of a new bytes
+    object, which saves an allocation and a copy per read. The data passed
+    to parsers is only valid until they return, so parsers must copy what
+    they keep, as the built-in parsers do.
+    """
+
+    __slots__ = ('_receive_buffer',)
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self._receive_buffer = get_receive_buffer(self.loop)
+
+    def get_buffer(self, sizehint):
+        return self._receive_buffer
+
+    def buffer_updated(self, nbytes):
+        with self._receive_buffer[:nbytes] as data:
+            self.data_received(data)
+
+
 class StreamParserContext:
+    __slots__ = (
+        'stream',
+        '_parser',
+        '_parsefunc',
+        '_error_handler',
+        '_buffer',
+        '_eof',
+    )
+
     def __init__(self, stream):
         self.stream = stream
 
@@ -88,6 +163,7 @@ class StreamParserContext:
         self._error_handler = None
 
         self._buffer = bytearray()
+        self._eof = False
 
     def _step_parser(self, arg):
         try:
@@ -101,9 +177,13 @@ class StreamParserContext:
     def _fail_parser(self, error):
         try:
             self._parser.throw(error)
+        except StopIteration:
+            # The parser handled the error and returned
+            self._parser = None
+            self._initialize_parser()
         except Exception as exc:
             if self._error_handler is not None:
-                self.loop.create_task(self._error_handler(exc))
+                self.stream.loop.create_task(self._error_handler(exc))
             else:
                 raise
 
@@ -122,6 +202,12 @@ class StreamParserContext:
     def set_error_handler(self, func):
         self._error_handler = func
 
+    def report_error(self, exc):
+        if self._error_handler is not None:
+            self.stream.loop.create_task(self._error_handler(exc))
+        else:
+            raise exc
+
     def set_parser(self, func):
         self._parsefunc = func
         self._parser = None
@@ -154,15 +240,34 @@ class StreamParserContext:
             self._initialize_parser()
 
     def feed_eof(self):
+        self._eof = True
         self._fail_parser(EOFError)
 
+    def feed_connection_lost(self, exc):
+        if self._eof:
+            return
+
+        self._eof = True
+
+        error = ConnectionResetError('Connection lost')
+        error.__cause__ = exc
+
+        try:
+            self._fail_parser(error)
+        except ConnectionError:
+            # Nothing is waiting for the connection, e.g. the handshake already failed
+            pass
+
 
 class Stream:
+    __slots__ = ('loop', 'protocol', '_ctx', '_capture')
+
     def __init__(self, *, loop):
         self.loop = loop
         self.protocol = None
 
         self._ctx = StreamParserContext(self)
+        self._capture = None
 
     def __repr__(self):
         attrs = [
@@ -177,10 +282,28 @@ class Stream:
         if self.protocol is not None:
             return self.protocol.transport
 
-    async def create_protocol(self, host, port, **kwargs):
+    async def create_protocol(self, host, port, *, socket_options=None, buffered=None, **kwargs):
+        if buffered is None:
+            # uvloop reads straight into a buffered protocol's buffer, saving a copy per read
+            buffered = is_uvloop(self.loop)
+
+        protocol_class = BufferedStreamProtocol if buffered else StreamProtocol
+
+        if socket_options is not None:
+            # The socket is tuned before it connects, so buffer sizes apply from the start
+            if kwargs.get('ssl'):
+                kwargs.setdefault('server_hostname', host)
+
+            kwargs['sock'] = await socket_options.connect(self.loop, host, port)
+            host = port = None
+
         _, self.protocol = await self.loop.create_connection(
-            lambda: StreamProtocol(self), host, port, **kwargs
+            lambda: protocol_class(self), host, port, **kwargs
         )
+
+        if socket_options is not None:
+            socket_options.apply_transport(self.protocol.transport)
+
         return self.protocol
 
     def set_parser(self, parser):
@@ -189,8 +312,28 @@ class Stream:
     def set_error_handler(self, func):
         self._ctx.set_error_handler(func)
 
+    def set_capture(self, capture):
+        """Starts or stops recording the data received by the stream.
+
+        Data that was received but not parsed yet is recorded first.
+
+        Arguments:
+            capture (Optional[TrafficCapture]): The capture to record to,
+                None stops recording.
+        """
+        buffer = self._ctx.get_buffer()
+        if capture is not None and buffer:
+            capture.record(bytes(buffer))
+
+        self._capture = capture
+
+    def report_error(self, exc):
+        self._ctx.report_error(exc)
+
     def write(self, data):
-        self.transport.write(getbytes(data))
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = getbytes(data)
+        self.transport.write(data)
 
     def writelines(self, data):
         self.transport.writelines(getbytes(line) for line in data)
@@ -202,8 +345,13 @@ class Stream:
         if self.transport is not None:
             self.transport.close()
 
+    def abort(self):
+        """Closes the transport immediately, discarding buffered data."""
+        if self.transport is not None:
+            self.transport.abort()
+
     def is_closing(self):
-        return self.transport.is_closing()
+        return self.transport is None or self.transport.is_closing()
 
     async def wait_until_drained(self):
         await self.protocol.wait_until_drained()
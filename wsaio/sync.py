@@ -0,0 +1,379 @@
+import select
+import socket
+import ssl as _ssl
+import threading
+import time
+
+from . import frame as wsframe
+from .connection import FIN, CloseEvent, PingEvent, WebSocketConnection
+from .exceptions import HandshakeFailureError, InvalidFrameError
+from .handshake import (
+    _LARGE_RESPONSE_MSG,
+    MAX_HEADER_SIZE,
+    build_request_template,
+    check_response,
+    parse_response_head,
+    parse_url,
+)
+from .util import genacckey, genseckey, mask
+
+_WOULD_BLOCK = (BlockingIOError, InterruptedError, _ssl.SSLWantReadError, _ssl.SSLWantWriteError)
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError('The operation timed out')
+
+    return remaining
+
+
+def _deadline(timeout):
+    if timeout is None:
+        return None
+    return time.monotonic() + timeout
+
+
+class WebSocketClient:
+    """A blocking WebSocket client that uses a plain socket.
+
+    It shares the framing rules of the asynchronous client through
+    `WebSocketConnection`. Frames can be sent from several threads at
+    once, while messages should be received by one thread at a time.
+
+    Arguments:
+        text_mode (str): How text payloads are delivered, 'str' decodes them
+            and 'bytes' passes the raw UTF-8 bytes through.
+
+        validate_utf8 (bool): Whether to validate text payloads in 'bytes' mode,
+            this should only be disabled for trusted peers.
+
+        buffer_size (int): The size of the buffer that data is received into.
+
+        max_frame_size (Optional[int]): The maximum payload size of outgoing
+            data frames, larger messages are split into continuation frames.
+    """
+
+    def __init__(
+        self, *, text_mode='str', validate_utf8=True, buffer_size=1 << 16, max_frame_size=None
+    ):
+        self.sock = None
+        self.connection = WebSocketConnection(
+            mask=True,
+            text_mode=text_mode,
+            validate_utf8=validate_utf8,
+            max_frame_size=max_frame_size,
+        )
+
+        self._buffer = bytearray(buffer_size)
+        self._events = None
+
+        self._io_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._recv_lock = threading.Lock()
+
+        self._opened = False
+        self._closing = False
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} sock={self.sock!r}>'
+
+    def is_opened(self):
+        return self._opened
+
+    def connect(
+        self, url, *, timeout=30, ssl=None, max_header_size=MAX_HEADER_SIZE, socket_options=None
+    ):
+        """Connects to a WebSocket server and performs the handshake.
+
+        Arguments:
+            url (str): The URL of the server.
+
+            timeout (Optional[float]): The timeout for connecting and the handshake.
+
+            ssl (Optional[ssl.SSLContext]): The context used for wss URLs,
+                a default context is used if omitted.
+
+            max_header_size (int): The maximum size of the handshake response headers.
+
+            socket_options (Optional[SocketOptions]): Options that are applied to
+                the socket before it connects, write buffer limits are ignored.
+        """
+        (host, port, path, query), secure = parse_url(url)
+        deadline = _deadline(timeout)
+
+        if socket_options is not None:
+            # The socket is tuned before it connects, so buffer sizes apply from the start
+            sock = socket_options.connect_blocking(host, port, timeout=timeout)
+        else:
+            sock = socket.create_connection((host, port), timeout=timeout)
+
+        try:
+            if secure:
+                if ssl is None:
+                    ssl = _ssl.create_default_context()
+                sock = ssl.wrap_socket(sock, server_hostname=host)
+
+            seckey = genseckey().encode('utf-8')
+            acckey = genacckey(seckey)
+
+            head, tail = build_request_template(host, port, path, query)
+            sock.sendall(b''.join((head, seckey, tail)))
+
+            headers, version, code = self._read_response(sock, deadline, max_header_size)
+            check_response(headers, version, code, acckey)
+        except BaseException:
+            sock.close()
+            raise
+
+        sock.setblocking(False)
+
+        self.sock = sock
+        self._opened = True
+
+    def _read_response(self, sock, deadline, max_header_size):
+        response = bytearray()
+        start = 0
+
+        while True:
+            index = response.find(b'\r\n\r\n', start)
+            if index != -1:
+                break
+
+            if len(response) > max_header_size:
+                raise HandshakeFailureError(_LARGE_RESPONSE_MSG.format(max_header_size))
+
+            try:
+                sock.settimeout(_remaining(deadline))
+                data = sock.recv(4096)
+            except (TimeoutError, socket.timeout):
+                raise HandshakeFailureError(
+                    'The handshake timed out while waiting for response'
+                ) from None
+
+            if not data:
+                raise HandshakeFailureError('The connection was closed during the handshake')
+
+            start = max(len(response) - 3, 0)
+            response.extend(data)
+
+        if index > max_header_size:
+            raise HandshakeFailureError(_LARGE_RESPONSE_MSG.format(max_header_size))
+
+        # Frames sent straight after the response belong to the connection
+        self.connection.receive_data(response[index + 4:])
+
+        return parse_response_head(response[:index])
+
+    def _wait(self, readable, deadline):
+        if readable and isinstance(self.sock, _ssl.SSLSocket) and self.sock.pending():
+            return
+
+        if readable:
+            ready = select.select((self.sock,), (), (), _remaining(deadline))[0]
+        else:
+            ready = select.select((), (self.sock,), (), _remaining(deadline))[1]
+
+        if not ready:
+            raise TimeoutError('The operation timed out')
+
+    def _sendall(self, data, deadline):
+        with memoryview(data) as view:
+            while view:
+                try:
+                    with self._io_lock:
+                        sent = self.sock.send(view)
+                except _WOULD_BLOCK:
+                    self._wait(False, deadline)
+                else:
+                    view = view[sent:]
+
+    def _recv_some(self, deadline):
+        while True:
+            try:
+                with self._io_lock:
+                    size = self.sock.recv_into(self._buffer)
+            except _WOULD_BLOCK:
+                self._wait(True, deadline)
+            else:
+                break
+
+        if not size:
+            self._opened = False
+            raise ConnectionResetError('The connection was closed by the peer')
+
+        with memoryview(self._buffer) as view:
+            self.connection.receive_data(view[:size])
+
+    def _send_with(self, func, *args, timeout=None, **kwargs):
+        if not self.is_opened():
+            raise RuntimeError('The WebSocket is not opened')
+
+        deadline = _deadline(timeout)
+
+        with self._send_lock:
+            func(*args, **kwargs)
+            self._sendall(self.connection.data_to_send(), deadline)
+
+    def send_frame(self, frame, *, timeout=None):
+        """Sends a frame, this and the other send methods are safe to call
+        from several threads.
+
+        Arguments:
+            frame (WebSocketFrame): The frame to send.
+
+            timeout (Optional[float]): The maximum time to wait for the socket
+                to accept the frame.
+
+        Raises:
+            TimeoutError: The frame could not be sent in time, the connection
+                should be considered broken as the frame may be partially sent.
+        """
+        self._send_with(self.connection.send_frame, frame, timeout=timeout)
+
+    def send(self, data, *, binary=False, timeout=None):
+        """Sends a data message.
+
+        The message is sent as continuation frames if the connection has a
+        max_frame_size, each fragment is masked just before it is sent so
+        that only one masked fragment is held at a time.
+
+        Arguments:
+            data (str | int | BytesLike): The data to send in the message.
+
+            binary (bool): Whether to send the message with the binary opcode.
+
+            timeout (Optional[float]): The maximum time to wait for the socket
+                to accept the message.
+        """
+        if not self.is_opened():
+            raise RuntimeError('The WebSocket is not opened')
+
+        deadline = _deadline(timeout)
+        head = FIN | (wsframe.OP_BINARY if binary else wsframe.OP_TEXT)
+
+        # The encoded fragments are dropped as they're sent, so only one is held at a time
+        frames = self.connection.prepare_message(head, data)
+        frames.reverse()
+
+        with self._send_lock:
+            while frames:
+                header, payload, key = frames.pop()
+                if key is not None:
+                    payload = mask(payload, key)
+
+                header.extend(payload)
+                self._sendall(header, deadline)
+
+    def ping(self, data=None, *, timeout=None):
+        self._send_with(self.connection.ping, data, timeout=timeout)
+
+    def pong(self, data=None, *, timeout=None):
+        self._send_with(self.connection.pong, data, timeout=timeout)
+
+    def recv(self, *, timeout=None):
+        """Receives the next event from the peer.
+
+        Pings are answered automatically and a close is echoed before
+        the socket is closed, both events are still returned.
+
+        Arguments:
+            timeout (Optional[float]): The maximum time to wait for an event.
+
+        Returns:
+            WebSocketEvent: The event, such as a `TextEvent` or `BinaryEvent`.
+
+        Raises:
+            TimeoutError: No event was received in time.
+
+            InvalidFrameError: The peer sent an invalid frame, the connection
+                is closed with the appropriate close code.
+        """
+        deadline = _deadline(timeout)
+
+        with self._recv_lock:
+            while True:
+                if self._events is None:
+                    self._events = self.connection.events()
+
+                try:
+                    event = next(self._events)
+                except StopIteration:
+                    self._events = None
+                except InvalidFrameError as exc:
+                    self._events = None
+                    self._fail(exc)
+                    raise
+                else:
+                    break
+
+                if not self.is_opened():
+                    raise RuntimeError('The WebSocket is not opened')
+
+                self._recv_some(deadline)
+
+        if isinstance(event, PingEvent):
+            self.pong(event.data, timeout=timeout)
+        elif isinstance(event, CloseEvent):
+            self._handle_close(event)
+
+        return event
+
+    def _fail(self, exc):
+        try:
+            if not self._closing:
+                self._closing = True
+                self._send_with(
+                    self.connection.close, exc.message[:123], code=exc.code, timeout=1
+                )
+        except OSError:
+            pass
+        finally:
+            self.shutdown()
+
+    def _handle_close(self, event):
+        try:
+            if not self._closing:
+                self._closing = True
+                code = event.code if event.code is not None else wsframe.WS_NORMAL_CLOSURE
+                self._send_with(self.connection.close, code=code, timeout=1)
+        except OSError:
+            pass
+        finally:
+            self.shutdown()
+
+    def close(self, data=None, *, code=wsframe.WS_NORMAL_CLOSURE, timeout=10):
+        """Starts the closing handshake and waits for the peer to echo it.
+
+        Arguments:
+            data (Optional[str | int | BytesLike]): The close reason.
+
+            code (int): The close code.
+
+            timeout (Optional[float]): The maximum time to wait for the peer's close.
+        """
+        if self._closing:
+            raise RuntimeError('The WebSocket cannot be closed more than once')
+
+        self._closing = True
+
+        try:
+            self._send_with(self.connection.close, data, code=code, timeout=timeout)
+
+            deadline = _deadline(timeout)
+            while not isinstance(self.recv(timeout=_remaining(deadline)), CloseEvent):
+                pass
+        except (OSError, InvalidFrameError, RuntimeError):
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Closes the socket without a closing handshake."""
+        self._opened = False
+
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,151 @@
+import weakref
+
+_wheels = weakref.WeakKeyDictionary()
+
+
+class WheelTimer:
+    """A timer scheduled on a `TimerWheel`, see `TimerWheel.call_later`."""
+
+    __slots__ = ('_wheel', '_callback', '_args', 'tick', '_state')
+
+    _PENDING = 0
+    _CANCELLED = 1
+    _EXPIRED = 2
+
+    def __init__(self, wheel, tick, callback, args):
+        self._wheel = wheel
+        self._callback = callback
+        self._args = args
+
+        self.tick = tick
+        self._state = self._PENDING
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} tick={self.tick} callback={self._callback!r}>'
+
+    def cancel(self):
+        """Cancels the timer, this does nothing if it already expired."""
+        if self._state == self._PENDING:
+            self._state = self._CANCELLED
+            self._wheel._remove(self)
+
+    def cancelled(self):
+        return self._state == self._CANCELLED
+
+    def expired(self):
+        return self._state == self._EXPIRED
+
+
+class TimerWheel:
+    """A hashed timer wheel for coarse-grained timeouts.
+
+    Timers are hashed into slots by the tick they expire on, so inserting
+    and cancelling a timer is O(1) no matter how many are pending, and the
+    event loop only has a single handle for the whole wheel. Timers expire
+    on the first tick at or after their deadline, so they may be up to one
+    resolution late but never early.
+
+    Arguments:
+        loop (asyncio.AbstractEventLoop): The event loop.
+
+        resolution (float): The number of seconds per tick.
+
+        size (int): The number of slots, timers further than size ticks
+            away are checked again when the wheel comes around.
+    """
+
+    def __init__(self, *, loop, resolution=0.1, size=512):
+        self.loop = loop
+        self.resolution = resolution
+        self.size = size
+
+        self._slots = [{} for _ in range(size)]
+        self._count = 0
+        self._tick = self._current_tick()
+        self._handle = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} resolution={self.resolution} timers={self._count}>'
+
+    def __len__(self):
+        return self._count
+
+    def _current_tick(self):
+        return int(self.loop.time() / self.resolution)
+
+    def call_later(self, delay, callback, *args):
+        """Schedules callback(*args) to be called after delay seconds.
+
+        Arguments:
+            delay (float): The number of seconds to wait.
+
+            callback (Callable): The function to call.
+
+        Returns:
+            WheelTimer: The timer, which can be cancelled.
+        """
+        if self._handle is None:
+            # The wheel doesn't turn while it's empty
+            self._tick = self._current_tick()
+            self._handle = self.loop.call_at((self._tick + 1) * self.resolution, self._turn)
+
+        tick = max(-int(-(self.loop.time() + delay) // self.resolution), self._tick + 1)
+
+        timer = WheelTimer(self, tick, callback, args)
+        self._slots[tick % self.size][timer] = None
+        self._count += 1
+
+        return timer
+
+    def _remove(self, timer):
+        del self._slots[timer.tick % self.size][timer]
+        self._count -= 1
+
+    def _turn(self):
+        now = self._current_tick()
+
+        # Ticks are caught up on if the event loop was blocked
+        while self._tick < now and self._count:
+            self._tick += 1
+
+            slot = self._slots[self._tick % self.size]
+            if not slot:
+                continue
+
+            expired = [timer for timer in slot if timer.tick <= self._tick]
+            for timer in expired:
+                # An earlier callback may have cancelled it
+                if timer._state != WheelTimer._PENDING:
+                    continue
+
+                self._remove(timer)
+                timer._state = WheelTimer._EXPIRED
+
+                try:
+                    timer._callback(*timer._args)
+                except (SystemExit, KeyboardInterrupt):
+                    raise
+                except BaseException as exc:
+                    self.loop.call_exception_handler(
+                        {
+                            'message': f'Exception in timer callback {timer._callback!r}',
+                            'exception': exc,
+                        }
+                    )
+
+        if self._count:
+            self._handle = self.loop.call_at((now + 1) * self.resolution, self._turn)
+        else:
+            self._handle = None
+
+            # The wheel references its loop, so it's only cached while it has timers
+            if _wheels.get(self.loop) is self:
+                del _wheels[self.loop]
+
+
+def get_timer_wheel(loop):
+    """Returns the timer wheel shared by the connections of an event loop."""
+    wheel = _wheels.get(loop)
+    if wheel is None:
+        wheel = _wheels[loop] = TimerWheel(loop=loop)
+    return wheel
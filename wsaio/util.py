@@ -1,13 +1,73 @@
 import base64
 import hashlib
 import os
+import random
+import time
 
 WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
 
 
+class MaskKeyPool:
+    """A source of masking keys that hands out keys from a batch of random bytes.
+
+    Arguments:
+        size (int): The number of keys to generate at once.
+
+        source (Callable[[int], bytes]): The function used to generate the
+            batch, defaults to `os.urandom`.
+    """
+
+    def __init__(self, *, size=4096, source=os.urandom):
+        self.size = size
+        self.source = source
+
+        self._buffer = b''
+        self._offset = 0
+
+    def __call__(self):
+        offset = self._offset
+        if offset >= len(self._buffer):
+            self._buffer = self.source(self.size * 4)
+            offset = 0
+
+        self._offset = offset + 4
+        return self._buffer[offset:offset + 4]
+
+    def reset(self):
+        """Discards the remaining keys in the batch."""
+        self._buffer = b''
+        self._offset = 0
+
+
+def zerosource(size):
+    """A masking key source that only produces zero keys, for benchmarks."""
+    return bytes(size)
+
+
+def seededsource(seed):
+    """Creates a deterministic masking key source, for benchmarks.
+
+    Arguments:
+        seed (int): The seed for the random number generator.
+    """
+    rand = random.Random(seed)
+
+    def source(size):
+        return rand.getrandbits(size * 8).to_bytes(size, 'big')
+
+    return source
+
+
+_mask_key_pool = MaskKeyPool()
+
+if hasattr(os, 'register_at_fork'):
+    # A forked child shouldn't hand out the same keys as its parent
+    os.register_at_fork(after_in_child=_mask_key_pool.reset)
+
+
 def genmask():
     """Generates a random masking key for a WebSocket frame."""
-    return os.urandom(4)
+    return _mask_key_pool()
 
 
 def mask(data, mask):
@@ -18,7 +78,49 @@ def mask(data, mask):
 
         mask (bytes): The masking key.
     """
-    return bytes(data[i] ^ mask[i % 4] for i in range(len(data)))
+    length = len(data)
+    key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+    return (int.from_bytes(data, 'big') ^ key).to_bytes(length, 'big')
+
+
+MASK_CHUNK_SIZE = 1 << 16
+
+# A masking key times this is the key repeated over a whole chunk
+_CHUNK_REPEAT = int.from_bytes(b'\x00\x00\x00\x01' * (MASK_CHUNK_SIZE // 4), 'big')
+
+
+def mask_chunked(data, mask):
+    """Applies a masking key to a byte string one chunk at a time.
+
+    This is meant to run in a thread, `mask` holds the GIL for the whole
+    payload while this releases it after every chunk, so the event loop
+    keeps running alongside it.
+
+    Arguments:
+        data (BytesLike): The data to apply the masking key to.
+
+        mask (bytes): The masking key.
+
+    Returns:
+        bytearray: The masked data.
+    """
+    length = len(data)
+    result = bytearray()
+    key = int.from_bytes(mask, 'big') * _CHUNK_REPEAT
+
+    with memoryview(data) as view:
+        # Chunks start at multiples of 4, so the key always lines up
+        for start in range(0, length, MASK_CHUNK_SIZE):
+            chunk = view[start:start + MASK_CHUNK_SIZE]
+            size = len(chunk)
+
+            chunk_key = key >> (8 * (MASK_CHUNK_SIZE - size))
+            result += (int.from_bytes(chunk, 'big') ^ chunk_key).to_bytes(size, 'big')
+
+            # A waiting thread would otherwise only get the GIL after the switch interval
+            time.sleep(0)
+
+    return result
 
 
 def genseckey():
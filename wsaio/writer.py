@@ -1,59 +1,100 @@
+import asyncio
+from collections import deque
+
 from . import frame as wsframe
 from . import util
+from .connection import FIN, WebSocketConnection, encode_payload
 
+_CLOSE_SENT_MSG = 'The close frame was already sent'
 
-class WebSocketWriter:
-    """A class for writing WebSocket frames to a stream."""
 
-    def __init__(self, *, stream):
-        self.stream = stream
+class WebSocketWriter:
+    """A class for writing WebSocket frames to a stream.
 
-    async def write_frame(self, frame, *, mask=False):
-        """Writes a frame to the stream.
+    The frames are encoded by a `WebSocketConnection`, the writer sends
+    its output to the stream.
 
-        Arguments:
-            frame (WebSocketFrame): The frame to write.
+    Arguments:
+        stream (Stream): The stream to write frames to.
 
-            mask (bool): Whether to send the frame with a mask.
-        """
-        if not isinstance(frame, wsframe.WebSocketFrame):
-            raise TypeError(f'frame should be a WebSocketFrame, got {type(frame).__name__!r}')
+        connection (Optional[WebSocketConnection]): The connection that encodes
+            frames, one is created if omitted.
 
-        frame.validate()
+        offload (Optional[OffloadPolicy]): The policy for masking large
+            payloads in an executor, frames are still written in order.
 
-        data = frame.data
-        if isinstance(data, str):
-            data = data.encode('utf-8')
+        genmask (Callable[[], bytes]): The function used to generate masking
+            keys when the connection is created by the writer.
+    """
 
-        length = len(data)
+    __slots__ = (
+        'stream',
+        'connection',
+        'offload',
+        '_write_waiter',
+        '_message_lock',
+        '_close_sent',
+        '_queue',
+    )
 
-        buffer = bytearray(2)
-        buffer[0] = frame.head
+    def __init__(self, *, stream, connection=None, offload=None, genmask=util.genmask):
+        if connection is None:
+            connection = WebSocketConnection(genmask=genmask)
 
-        masked = mask << 7
-
-        if length < 126:
-            buffer[1] = masked | length
-        elif length < (1 << 16):
-            buffer[1] = masked | 126
-            buffer.extend(length.to_bytes(2, 'big', signed=False))
+        self.stream = stream
+        self.connection = connection
+        self.offload = offload
+
+        self._write_waiter = None
+        self._message_lock = None
+        self._close_sent = False
+        self._queue = None
+
+    async def _write_offloaded(self, buffer, data, mask):
+        # Frames are written in call order even if an earlier, larger
+        # payload is still being masked in the executor.
+        waiter = self._write_waiter
+        done = self._write_waiter = self.stream.loop.create_future()
+
+        try:
+            data = await self.offload.run(
+                self.stream.loop, len(data), util.mask_chunked, data, mask
+            )
+
+            if waiter is not None:
+                await asyncio.shield(waiter)
+
+            self._write_encoded(buffer, data)
+        finally:
+            done.set_result(None)
+            if self._write_waiter is done:
+                self._write_waiter = None
+
+    def _write_encoded(self, header, data):
+        header.extend(data)
+        self.stream.write(header)
+
+    async def _write_prepared(self, buffer, data, key):
+        if key is None:
+            self._write_encoded(buffer, data)
+        elif self.offload is None:
+            self._write_encoded(buffer, util.mask(data, key))
+        elif self._write_waiter is None and not self.offload.should_offload(len(data)):
+            self._write_encoded(buffer, self.offload.run_inline(util.mask, data, key))
         else:
-            buffer[1] = masked | 127
-            buffer.extend(length.to_bytes(8, 'big', signed=False))
+            await self._write_offloaded(buffer, data, key)
 
-        if frame.code is not None:
-            data = frame.code.to_bytes(2, 'big', signed=False) + data
+        await self.stream.wait_until_drained()
 
-        if mask:
-            mask = util.genmask()
-            buffer.extend(mask)
-            buffer.extend(util.mask(data, mask))
-        else:
-            buffer.extend(data)
+    async def write_frame(self, frame, *, mask=False):
+        """Writes a frame to the stream.
 
-        self.stream.write(buffer)
+        Arguments:
+            frame (WebSocketFrame): The frame to write.
 
-        await self.stream.wait_until_drained()
+            mask (bool): Whether to send the frame with a mask.
+        """
+        await self._write_prepared(*self.connection.prepare_frame(frame, mask=mask))
 
     async def ping(self, data=None, *, mask=False):
         """Writes a ping frame to the stream.
@@ -63,8 +104,8 @@ class WebSocketWriter:
 
             mask (bool): Whether to send the frame with a mask.
         """
-        frame = wsframe.WebSocketFrame(op=wsframe.OP_PING, data=data)
-        await self.write_frame(frame, mask=mask)
+        head = FIN | wsframe.OP_PING
+        await self._write_prepared(*self.connection.prepare(head, data, mask=mask))
 
     async def pong(self, data=None, *, mask=False):
         """Writes a pong frame to the stream.
@@ -74,12 +115,15 @@ class WebSocketWriter:
 
             mask (bool): Whether to send the frame with a mask.
         """
-        frame = wsframe.WebSocketFrame(op=wsframe.OP_PONG, data=data)
-        await self.write_frame(frame, mask=mask)
+        head = FIN | wsframe.OP_PONG
+        await self._write_prepared(*self.connection.prepare(head, data, mask=mask))
 
     async def close(self, data=None, *, code=wsframe.WS_NORMAL_CLOSURE, mask=False):
         """Writes a close frame to the stream.
 
+        The stream is left open so that the peer's close frame can still be
+        received, the caller is responsible for closing it afterwards.
+
         Arguments:
             data (Optional[str | int | BytesLike]): The data to send in the frame.
 
@@ -87,23 +131,109 @@ class WebSocketWriter:
 
             mask (bool): Whether to send the frame with a mask.
         """
-        frame = wsframe.WebSocketFrame(op=wsframe.OP_CLOSE, data=data, code=code)
-        await self.write_frame(frame, mask=mask)
+        head = FIN | wsframe.OP_CLOSE
+        frame = self.connection.prepare(head, data, code=code, mask=mask)
 
-        self.stream.close()
+        # A fragmented message that is being written stops before its next fragment
+        self._close_sent = True
+        await self._write_prepared(*frame)
 
     async def write(self, data, *, binary=False, mask=False):
-        """Writes a data frame to the stream.
+        """Writes a data message to the stream.
+
+        The message is sent as continuation frames if the connection has a
+        max_frame_size, each fragment is masked just before it is written
+        and the stream is drained between fragments. Control frames may be
+        written between fragments, other messages wait for them.
 
         Arguments:
-            data (str | int | BytesLike): The data to send in the frame.
+            data (str | int | BytesLike): The data to send in the message,
+                text messages accept already encoded UTF-8 bytes as-is.
 
-            binary (bool): Whether to send the frame with the binary opcode,
+            binary (bool): Whether to send the message with the binary opcode,
                 this should be used if the data isn't utf-8.
 
-            mask (bool): Whether to send the frame with a mask.
+            mask (bool): Whether to send the frames with a mask.
+
+        Raises:
+            ConnectionResetError: A close frame was written before the whole
+                message was.
+        """
+        if self._close_sent:
+            raise ConnectionResetError(_CLOSE_SENT_MSG)
+
+        head = FIN | (wsframe.OP_BINARY if binary else wsframe.OP_TEXT)
+        frames = self.connection.prepare_message(head, data, mask=mask)
+
+        lock = self._message_lock
+        if len(frames) == 1 and (lock is None or not lock.locked()):
+            await self._write_prepared(*frames[0])
+            return
+
+        if lock is None:
+            lock = self._message_lock = asyncio.Lock()
+
+        # The encoded fragments are dropped as they're written, so only one is held at a time
+        frames.reverse()
+
+        async with lock:
+            while frames:
+                if self._close_sent:
+                    raise ConnectionResetError(_CLOSE_SENT_MSG)
+
+                await self._write_prepared(*frames.pop())
+
+    def write_nowait(self, data, *, binary=False):
+        """Writes a data message without waiting for the stream to drain.
+
+        The message is written right away if nothing else is being written,
+        otherwise it is queued and a task writes the queue in order once the
+        earlier messages are done. Messages are dropped once a close frame
+        was written or the connection is lost.
+
+        Arguments:
+            data (str | int | BytesLike): The data to send in the message.
+
+            binary (bool): Whether to send the message with the binary opcode.
         """
-        frame = wsframe.WebSocketFrame(
-            op=wsframe.OP_BINARY if binary else wsframe.OP_TEXT, data=data
-        )
-        await self.write_frame(frame, mask=mask)
+        if self._close_sent:
+            return
+
+        # Invalid data raises here rather than in the task
+        data = encode_payload(data)
+
+        lock = self._message_lock
+        if (
+            self._queue is None
+            and self._write_waiter is None
+            and (lock is None or not lock.locked())
+            and (self.offload is None or not self.offload.should_offload(len(data)))
+        ):
+            head = FIN | (wsframe.OP_BINARY if binary else wsframe.OP_TEXT)
+            frames = self.connection.prepare_message(head, data)
+
+            if len(frames) == 1:
+                header, payload, key = frames[0]
+                if key is not None:
+                    payload = util.mask(payload, key)
+
+                self._write_encoded(header, payload)
+                return
+
+        if self._queue is None:
+            self._queue = deque()
+            self.stream.loop.create_task(self._write_queue())
+
+        self._queue.append((data, binary))
+
+    async def _write_queue(self):
+        try:
+            while self._queue:
+                data, binary = self._queue[0]
+                await self.write(data, binary=binary, mask=self.connection.mask)
+                self._queue.popleft()
+        except ConnectionError:
+            # The connection is closing, the peer won't read the rest
+            pass
+        finally:
+            self._queue = None